@@ -16,24 +16,21 @@ URL.
 from django.conf.urls.defaults import *
 from django.views.generic.simple import direct_to_template
 from django.contrib.auth import views as auth_views
-from django.views.generic.list_detail import object_list
 
+from registration.models import RegistrationProfile
 from registration.views import activate
 from registration.views import register
 
-from approvals.forms import RegistrationFormNeedsApproval
-
-# We import the 'approval_acted_on' signal from approvals.models and then
-# we register a handler for it. This is so that we can now when approvals
-# have been acted upon, and if the approval is for a RegistrationProfile
-# object (as created by RegistrationFormNeedsApproval) we can decide
-# whether or not to send the registration activation email.
+# Importing 'approvals.registration_support' also registers its
+# handlers for approvals of RegistrationProfile objects, as created by
+# RegistrationFormNeedsApproval, which send the activation email once
+# they are approved. Processes that never load this URLConf, like the
+# outbox worker, get them through `APPROVALS_HANDLER_MODULES` (see
+# `approvals.registry`).
 #
-from approvals.models import approval_acted_on, Approval
-from approvals.decorators import is_staff
-from approvals.actions import register_user
-
-approval_acted_on.connect(register_user)
+from approvals.registration_support import RegistrationFormNeedsApproval
+from approvals.decorators import is_approver
+from approvals.views import pending_approvals
 
 ##########################
 #
@@ -84,9 +81,9 @@ urlpatterns = patterns(
         {'template': 'registration/registration_complete.html'},
         name='registration_complete'),
     url(r'^approval/$',
-        is_staff(object_list),
-        { 'queryset' : Approval.objects.filter(approved = None).filter(content_type__app_label = 'registration'),
-          'paginate_by' : 20,
+        is_approver(pending_approvals),
+        { 'models' : [RegistrationProfile],
+          'per_page' : 20,
           'template_name' : 'registration/approvals_list.html'},
         name = 'registration_approvals_list'),
     )
@@ -1,12 +1,108 @@
 from django.contrib import admin
+from django.utils.translation import ugettext_lazy as _
 
-from approvals.models import Approval
+from approvals import recipients
+from approvals.models import Approval, ArchivedApproval, OutboxEntry
+from approvals.models import ApprovalPolicy, ApprovalAssignment, ApprovalVote
+
+
+def vote_selected(modeladmin, request, queryset, approval_status):
+    # Only the approvals the user is an approver of are voted on, as in
+    # `approvals.views.act_on_approvals`. Approvals whose policy needs
+    # more than one approver are only voted on, see
+    # `ApprovalQuerySet.vote()`.
+    #
+    mine = recipients.approvable_by(request.user)
+    skipped = queryset.exclude(mine).count()
+    decided, waiting = queryset.filter(mine).vote(approval_status,
+                                                  request.user)
+    if approval_status:
+        modeladmin.message_user(request, _("%d approvals approved.") %
+                                len(decided))
+    else:
+        modeladmin.message_user(request, _("%d approvals denied.") %
+                                len(decided))
+    if waiting:
+        modeladmin.message_user(request, _("Your vote was recorded on %d "
+                                           "approvals that need more "
+                                           "approvers.") % len(waiting))
+    if skipped:
+        modeladmin.message_user(request, _("%d approvals were skipped as "
+                                           "you are not one of their "
+                                           "approvers.") % skipped)
+
+
+def approve_selected(modeladmin, request, queryset):
+    vote_selected(modeladmin, request, queryset, True)
+approve_selected.short_description = _("Approve selected approvals")
+
+
+def deny_selected(modeladmin, request, queryset):
+    vote_selected(modeladmin, request, queryset, False)
+deny_selected.short_description = _("Deny selected approvals")
 
 
 class ApprovalAdmin(admin.ModelAdmin):
     list_display = ('__unicode__', 'created', 'content_type')
+    actions = [approve_selected, deny_selected]
     list_filter = ('approved', 'created', 'when_acted_on', 'content_type')
     search_fields = ('acted_on_by__username', 'acted_on_by__first_name',
                      'reason')
 
+    def queryset(self, request):
+        # '__unicode__' shows the object each approval is for, so fetch
+        # those in bulk instead of one at a time per row.
+        #
+        return super(ApprovalAdmin, self).queryset(request).with_targets()
+
 admin.site.register(Approval, ApprovalAdmin)
+
+
+class ArchivedApprovalAdmin(admin.ModelAdmin):
+    list_display = ('__unicode__', 'created', 'content_type', 'archived')
+    list_filter = ('approved', 'created', 'when_acted_on', 'content_type')
+    search_fields = ('acted_on_by__username', 'acted_on_by__first_name',
+                     'reason')
+
+    def queryset(self, request):
+        return super(ArchivedApprovalAdmin,
+                     self).queryset(request).with_targets()
+
+    def has_add_permission(self, request):
+        # Approvals only get in to the archive by being archived.
+        #
+        return False
+
+admin.site.register(ArchivedApproval, ArchivedApprovalAdmin)
+
+
+class OutboxEntryAdmin(admin.ModelAdmin):
+    list_display = ('__unicode__', 'kind', 'status', 'attempts',
+                    'next_attempt', 'sent')
+    list_filter = ('status', 'kind')
+    raw_id_fields = ('approval',)
+
+admin.site.register(OutboxEntry, OutboxEntryAdmin)
+
+
+class ApprovalAssignmentInline(admin.TabularInline):
+    model = ApprovalAssignment
+    raw_id_fields = ('user',)
+
+
+class ApprovalPolicyAdmin(admin.ModelAdmin):
+    list_display = ('content_type', 'quorum', 'expire_after_days',
+                    'expire_action')
+    inlines = [ApprovalAssignmentInline]
+
+admin.site.register(ApprovalPolicy, ApprovalPolicyAdmin)
+
+
+class ApprovalVoteAdmin(admin.ModelAdmin):
+    list_display = ('__unicode__', 'approval_id', 'user', 'approved',
+                    'created')
+    list_filter = ('approved', 'created')
+    search_fields = ('user__username', 'reason')
+    raw_id_fields = ('user',)
+
+admin.site.register(ApprovalVote, ApprovalVoteAdmin)
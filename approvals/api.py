@@ -0,0 +1,267 @@
+#
+# File: $Id$
+#
+"""
+A small JSON API over the approvals, for dashboards and scripts that
+poll the pending queue.
+
+The list and detail views send an ETag, and the detail view a
+Last-Modified header, and answer a conditional GET with '304 Not
+Modified' when nothing has changed. For the list that is decided by
+one aggregate query, the number of approvals in the queue and the
+latest time one of them was modified, so a client polling an
+unchanged queue costs one small query and no serialization at all.
+The list has no Last-Modified: deciding an approval takes it out of
+the queue without making the queue's latest modification time any
+later, so a time alone can not tell that the queue changed.
+"""
+
+# Python standard imports
+#
+import time
+
+# Django imports
+#
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.http import HttpResponseForbidden
+from django.http import HttpResponseNotModified, Http404
+from django.utils import simplejson
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.http import parse_etags, quote_etag
+
+# Model imports
+#
+from django.contrib.contenttypes.models import ContentType
+from approvals.models import Approval, ArchivedApproval
+
+# Form imports
+#
+from approvals.forms import DecisionForm
+
+# Approvals imports
+#
+from approvals import recipients
+from approvals.metrics import timed
+from approvals.views import encode_cursor, decode_cursor
+
+# The most approvals a client may ask for in one page of the list.
+#
+MAX_PER_PAGE = 100
+
+####################################################################
+#
+def serialize(approval):
+    """
+    The dictionary we send for an approval, live or archived.
+
+    Arguments:
+    - `approval`: An Approval or ArchivedApproval.
+    """
+    ct = approval.content_type
+    target = approval.__class__.needs_approval
+    acted_on_by = approval.acted_on_by
+    return { 'id'             : approval.id,
+             'content_type'   : "%s.%s" % (ct.app_label, ct.model),
+             'object_key'     : target.target_key(approval),
+             'object'         : unicode(approval.needs_approval),
+             'approved'       : approval.approved,
+             'reason'         : approval.reason,
+             'acted_on_by'    : acted_on_by and acted_on_by.username or None,
+             'when_acted_on'  : approval.when_acted_on,
+             'created'        : approval.created,
+             'modified'       : approval.modified,
+             'archived'       : isinstance(approval, ArchivedApproval),
+             'url'            : approval.act_on_url() }
+
+####################################################################
+#
+def json_response(data, status = 200):
+    """
+    Return an HttpResponse with `data` encoded as JSON.
+    """
+    return HttpResponse(simplejson.dumps(data, cls = DjangoJSONEncoder),
+                        mimetype = 'application/json', status = status)
+
+####################################################################
+#
+def not_modified(request, etag, last_modified):
+    """
+    True if the conditional GET headers of `request` say the client
+    already has the version described by `etag` and `last_modified`.
+    If-None-Match wins when both are sent, as the ETag is exact and
+    Last-Modified is only good to the second.
+
+    Arguments:
+    - `request`: Django request object.
+    - `etag`: The unquoted ETag of the current version.
+    - `last_modified`: The current version's time in seconds since the
+                       epoch, or None.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and last_modified is not None:
+        since = parse_http_date_safe(if_modified_since)
+        return since is not None and last_modified <= since
+    return False
+
+####################################################################
+#
+def conditional(request, etag, modified, build):
+    """
+    Answer a GET with '304 Not Modified' if the client is up to date or
+    the JSON for the data `build()` returns otherwise, with the ETag
+    and Last-Modified headers set either way.
+
+    Arguments:
+    - `request`: Django request object.
+    - `etag`: The unquoted ETag of the current version.
+    - `modified`: The datetime the data was last modified, or None.
+    - `build`: Callable returning the data to send, only called when
+               the client needs it.
+    """
+    last_modified = None
+    if modified is not None:
+        last_modified = int(time.mktime(modified.timetuple()))
+
+    if not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        response = json_response(build())
+    response['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+####################################################################
+#
+@timed('approvals.views.api.approval_list')
+def approval_list(request):
+    """
+    The user's inbox, the pending approvals they may act on and have
+    not voted on, oldest first, a page at a time. GET parameters:
+
+    - `content_type`: 'app_label.model' of the approvals to list. May
+                      be given more than once. All types by default.
+    - `after`: The 'next' cursor from the previous page.
+    - `per_page`: The number of approvals on a page, at most
+                  `MAX_PER_PAGE`.
+
+    The response has the list of 'approvals', the 'next' cursor (null
+    on the last page) and the 'count' of approvals in the queue.
+
+    Arguments:
+    - `request`: Django request object.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    content_types = None
+    if request.GET.getlist('content_type'):
+        content_types = []
+        for name in request.GET.getlist('content_type'):
+            try:
+                app_label, model = name.split('.')
+                content_types.append(
+                    ContentType.objects.get_by_natural_key(app_label, model))
+            except (ValueError, ContentType.DoesNotExist):
+                return json_response({ 'error' : "Unknown content type "
+                                       "'%s'" % name }, status = 400)
+    try:
+        per_page = max(1, min(int(request.GET.get('per_page', 20)),
+                              MAX_PER_PAGE))
+    except ValueError:
+        per_page = 20
+    after = decode_cursor(request.GET.get('after'))
+
+    # Anything that changes the queue either changes how many
+    # approvals are in it or, when one is added, its latest
+    # modification time. The page itself is part of the URL. Only the
+    # ETag has the count, so there is no Last-Modified.
+    #
+    queue = Approval.objects.pending(content_types, request.user)
+    stats = queue.aggregate(count = Count('id'), modified = Max('modified'))
+    etag = "%d-%s" % (stats['count'], stats['modified'] and
+                      stats['modified'].strftime('%Y%m%d%H%M%S%f') or '')
+
+    def build():
+        approvals, next_cursor = Approval.objects.pending_page(
+            content_types, after, per_page, request.user)
+        return { 'approvals' : [serialize(a) for a in approvals],
+                 'next'      : next_cursor and encode_cursor(next_cursor),
+                 'count'     : stats['count'] }
+    return conditional(request, etag, None, build)
+
+####################################################################
+#
+def get_approval(object_id):
+    """
+    Return the live or archived approval with the given id, raising
+    Http404 if there is neither.
+    """
+    for model in (Approval, ArchivedApproval):
+        try:
+            return model.objects.select_related(
+                'acted_on_by', 'content_type').get(pk = object_id)
+        except model.DoesNotExist:
+            pass
+    raise Http404
+
+####################################################################
+#
+@timed('approvals.views.api.approval_detail')
+def approval_detail(request, object_id):
+    """
+    One approval, live or archived.
+
+    Arguments:
+    - `request`: Django request object.
+    - `object_id`: The id of the approval.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    approval = get_approval(object_id)
+    etag = "%d-%s" % (approval.id,
+                      approval.modified.strftime('%Y%m%d%H%M%S%f'))
+    return conditional(request, etag, approval.modified,
+                       lambda: serialize(approval))
+
+####################################################################
+#
+@timed('approvals.views.api.approval_decision')
+def approval_decision(request, object_id):
+    """
+    Vote to approve or deny an approval. POST 'approved' as 'True' or
+    'False' and, optionally, a 'reason'. The vote decides the approval
+    if its policy says so (see `Approval.vote()`).
+
+    Responds with the approval, which is still pending if the vote did
+    not decide it, or with '409 Conflict' and the approval as it stands
+    if it had already been decided, by this request's user or anyone
+    else. Invalid input gets '400 Bad Request' with the form's errors
+    and users that are not approvers of the approval get '403
+    Forbidden'.
+
+    Arguments:
+    - `request`: Django request object.
+    - `object_id`: The id of the approval.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    approval = get_approval(object_id)
+    if not recipients.is_approver(request.user, approval.content_type_id):
+        return HttpResponseForbidden()
+
+    form = DecisionForm(request.POST)
+    if not form.is_valid():
+        return json_response({ 'errors' : form.errors }, status = 400)
+
+    if isinstance(approval, Approval) and \
+            approval.vote(form.cleaned_data['approved'], request.user,
+                          form.cleaned_data.get('reason') or None):
+        return json_response(serialize(approval))
+    return json_response(serialize(get_approval(object_id)), status = 409)
@@ -0,0 +1,62 @@
+#
+# File: $Id$
+#
+"""
+The pluggable parts of the approvals app.
+
+Each backend is named by a setting holding the dotted path of a class,
+such as `APPROVALS_NOTIFIER` or `APPROVALS_METRICS_BACKEND`. Nothing is
+imported until the backend is first used; it is then loaded and
+created once and the same instance is used from then on. So a process
+that never sends a notification never imports django-notification or
+django-mailer, and a setting naming a module that is not there only
+fails when that backend is actually needed.
+"""
+
+# Django imports
+#
+from django.conf import settings
+
+# Approvals imports
+#
+from approvals.utils import load_object
+
+# The backends created so far, by the name of their setting.
+#
+_backends = {}
+
+####################################################################
+#
+def get_backend(setting, default):
+    """
+    Return the backend named by `setting`, creating it the first time
+    it is asked for.
+
+    Arguments:
+    - `setting`: The name of the setting holding the dotted path of the
+                 backend's class.
+    - `default`: The dotted path to use when the setting is not set, or
+                 a callable returning it, which is only called then.
+    """
+    try:
+        return _backends[setting]
+    except KeyError:
+        pass
+    path = getattr(settings, setting, None)
+    if path is None:
+        path = callable(default) and default() or default
+    backend = _backends[setting] = load_object(path)()
+    return backend
+
+####################################################################
+#
+def reset(setting = None):
+    """
+    Forget the backend for `setting`, or all of them, so that it is
+    loaded again from the settings the next time it is used.
+    """
+    if setting is None:
+        _backends.clear()
+    else:
+        _backends.pop(setting, None)
+    return
@@ -8,6 +8,8 @@ Useful decorators for restricting who has access to all of the pending approvals
 from django.conf import settings
 from django.contrib.auth.decorators import user_passes_test
 
+from approvals import recipients
+
 ###########################################################################
 #
 def is_staff(function = None):
@@ -21,3 +23,18 @@ def is_staff(function = None):
         return actual_decorator(function)
     return actual_decorator
 
+
+###########################################################################
+#
+def is_approver(function = None):
+    """
+    Decorator for views in the approvals app that requires the user to
+    be an approver of something: assigned to an approval policy or, for
+    the approvals that have no assigned approvers, staff. Which
+    approvals they may act on is checked by the views.
+    """
+    actual_decorator = user_passes_test(recipients.is_approver,
+                                        login_url = settings.LOGIN_URL)
+    if function:
+        return actual_decorator(function)
+    return actual_decorator
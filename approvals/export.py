@@ -0,0 +1,215 @@
+#
+# File: $Id$
+#
+"""
+Exporting the history of the approvals, live and archived, as CSV or
+as JSON lines, for auditing: who acted on what, when and why.
+
+However many approvals there are the export runs in bounded memory.
+Each table is read a chunk at a time, walking the index on 'created'
+with a (created, id) cursor, with 'acted_on_by' and 'content_type'
+joined in and the objects the chunk's approvals are for fetched in one
+query per content type. The two tables are merged in to one stream in
+(created, id) order, so the 'created' and 'id' of the last row
+written make a cursor, 'created,id', that a later export can carry on
+from. Times are written with their microseconds so that the cursor is
+exact.
+
+Used by the 'export_approvals' management command and the
+'approvals.views.export_approvals' view.
+"""
+
+# Python standard imports
+#
+import csv
+import heapq
+import datetime
+from cStringIO import StringIO
+
+# Django imports
+#
+from django.db.models import Q
+from django.utils import simplejson
+
+# Model imports
+#
+from django.contrib.contenttypes.models import ContentType
+from approvals.models import Approval, ArchivedApproval, prefetch_targets
+
+# The columns of the export, in order.
+#
+FIELDS = ('id', 'content_type', 'object_key', 'object', 'approved',
+          'acted_on_by', 'when_acted_on', 'reason', 'created', 'modified',
+          'archived')
+
+# The formats we export in, and their content types.
+#
+FORMATS = { 'csv'   : 'text/csv',
+            'jsonl' : 'application/x-json-stream' }
+
+# The date formats accepted for the start and end of the export and in
+# cursors.
+#
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+####################################################################
+#
+def parse_date(value):
+    """
+    Parse `value` as a date, with or without a time, as given for the
+    start or end of an export. Raises ValueError if it is neither.
+    """
+    for format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError("'%s' is not a date (YYYY-MM-DD[ HH:MM:SS])" % value)
+
+####################################################################
+#
+def parse_cursor(value):
+    """
+    Parse a 'created,id' cursor, the 'created' and 'id' of the last row
+    of an earlier export, in to a (created, id) tuple. Raises
+    ValueError if it is not one.
+    """
+    try:
+        created, id = value.rsplit(',', 1)
+        return (parse_date(created.strip()), int(id))
+    except ValueError:
+        raise ValueError("'%s' is not a 'created,id' cursor" % value)
+
+####################################################################
+#
+def parse_content_types(names):
+    """
+    Return the ContentTypes named 'app_label.model' in `names`. Raises
+    ValueError for a name that is not a content type.
+    """
+    content_types = []
+    for name in names:
+        try:
+            app_label, model = name.split('.')
+            content_types.append(
+                ContentType.objects.get_by_natural_key(app_label, model))
+        except (ValueError, ContentType.DoesNotExist):
+            raise ValueError("Unknown content type '%s'" % name)
+    return content_types
+
+####################################################################
+#
+def history(model, since = None, until = None, after = None,
+            content_types = None, chunk_size = 1000):
+    """
+    Generate the approvals of `model` in (created, id) order, reading
+    them `chunk_size` at a time. See `approvals()` for the arguments.
+    """
+    qs = model.objects.select_related('acted_on_by', 'content_type')
+    if since is not None:
+        qs = qs.filter(created__gte = since)
+    if until is not None:
+        qs = qs.filter(created__lt = until)
+    if content_types is not None:
+        qs = qs.filter(content_type__in = content_types)
+    qs = qs.order_by('created', 'id')
+
+    while True:
+        chunk = qs
+        if after is not None:
+            created, id = after
+            chunk = chunk.filter(Q(created__gt = created) |
+                                 Q(created = created, id__gt = id))
+        approvals = list(chunk[:chunk_size].iterator())
+        if not approvals:
+            return
+        prefetch_targets(approvals)
+        for approval in approvals:
+            yield approval
+        after = (approvals[-1].created, approvals[-1].id)
+
+####################################################################
+#
+def approvals(since = None, until = None, after = None, content_types = None,
+              chunk_size = 1000):
+    """
+    Generate all of the approvals, live and archived, in (created, id)
+    order.
+
+    Arguments:
+    - `since`: Only approvals created at or after this datetime.
+    - `until`: Only approvals created before this datetime.
+    - `after`: A (created, id) cursor, as from the last row of an
+               earlier export. Only approvals after it are generated.
+    - `content_types`: Optional list of the ContentTypes to export.
+    - `chunk_size`: The number of approvals to read at a time from
+                    each table.
+    """
+    streams = [((a.created, a.id, a) for a in
+                history(model, since, until, after, content_types,
+                        chunk_size))
+               for model in (ArchivedApproval, Approval)]
+    for created, id, approval in heapq.merge(*streams):
+        yield approval
+
+####################################################################
+#
+def row(approval):
+    """
+    The values exported for `approval`, in the order of `FIELDS`, with
+    times as strings to the microsecond. These are the values of the
+    JSON API's `approvals.api.serialize()` without the 'url', which
+    would cost a `reverse()` per row and need the app's URLConf.
+    """
+    ct = approval.content_type
+    acted_on_by = approval.acted_on_by
+    values = [approval.id,
+              "%s.%s" % (ct.app_label, ct.model),
+              approval.__class__.needs_approval.target_key(approval),
+              unicode(approval.needs_approval),
+              approval.approved,
+              acted_on_by and acted_on_by.username or None,
+              approval.when_acted_on,
+              approval.reason,
+              approval.created,
+              approval.modified,
+              isinstance(approval, ArchivedApproval)]
+    for i, value in enumerate(values):
+        if isinstance(value, datetime.datetime):
+            values[i] = unicode(value)
+    return values
+
+####################################################################
+#
+def csv_value(value):
+    """
+    A value as a UTF-8 string for the csv module, which only does
+    byte strings.
+    """
+    if value is None:
+        return ''
+    return unicode(value).encode('utf-8')
+
+####################################################################
+#
+def export(format, rows):
+    """
+    Generate the export of `rows`, the approvals to export, in `format`
+    ('csv' or 'jsonl') as strings, a line at a time.
+    """
+    if format == 'csv':
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(FIELDS)
+        yield buffer.getvalue()
+        for approval in rows:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([csv_value(value) for value in row(approval)])
+            yield buffer.getvalue()
+    elif format == 'jsonl':
+        for approval in rows:
+            yield simplejson.dumps(dict(zip(FIELDS, row(approval)))) + '\n'
+    else:
+        raise ValueError("Unknown export format: %s" % format)
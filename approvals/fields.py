@@ -0,0 +1,163 @@
+#
+# File: $Id$
+#
+"""
+The generic foreign key used by approvals to refer to the object that
+needs approval.
+
+Django's own GenericForeignKey keeps the primary key of the object in
+a single column. Ours has two: an integer column for objects whose
+primary key is an integer and a short character column for everything
+else (UUIDs, slugs and so on). Both are indexed along with the content
+type, so a lookup is an index lookup on a column of the right type
+whichever kind of key the object has, and the vast majority of objects,
+with integer keys, keep the compact integer column they always had.
+"""
+
+# Django imports
+#
+from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.contenttypes import generic
+
+# The internal types of the fields whose values we keep in the integer
+# column.
+#
+INTEGER_FIELD_TYPES = ('AutoField', 'IntegerField', 'PositiveIntegerField',
+                       'SmallIntegerField', 'PositiveSmallIntegerField',
+                       'BigIntegerField')
+
+####################################################################
+#
+def has_integer_key(model):
+    """
+    True if the primary key of `model` is an integer, following
+    primary keys that are themselves foreign keys (as with multi-table
+    inheritance) to the field they refer to.
+    """
+    pk = model._meta.pk
+    while pk.rel is not None:
+        pk = pk.rel.get_related_field()
+    return pk.get_internal_type() in INTEGER_FIELD_TYPES
+
+####################################################################
+#
+class TargetForeignKey(generic.GenericForeignKey):
+    """
+    A GenericForeignKey that stores integer primary keys in `fk_field`
+    and any other kind of primary key, as a string, in `key_field`.
+    Exactly one of the two is set on an instance that refers to
+    something.
+    """
+
+    ####################################################################
+    #
+    def __init__(self, ct_field = "content_type", fk_field = "object_id",
+                 key_field = "object_key"):
+        super(TargetForeignKey, self).__init__(ct_field, fk_field)
+        self.key_field = key_field
+
+    ####################################################################
+    #
+    def key_attname(self, model):
+        """
+        The name of the field that holds the primary key of an object of
+        `model`.
+        """
+        if has_integer_key(model):
+            return self.fk_field
+        return self.key_field
+
+    ####################################################################
+    #
+    def key_value(self, model, pk):
+        """
+        Convert a primary key of `model` to the value stored for it.
+        """
+        if pk is None or has_integer_key(model):
+            return pk
+        return unicode(pk)
+
+    ####################################################################
+    #
+    def lookup(self, model, pks):
+        """
+        Return the keyword arguments for `filter()` that match the
+        instances referring to the objects of `model` with the given
+        primary keys. The content type is not included.
+
+        Arguments:
+        - `model`: The model class of the objects.
+        - `pks`: A list of their primary keys.
+        """
+        return { '%s__in' % self.key_attname(model) :
+                     [self.key_value(model, pk) for pk in pks] }
+
+    ####################################################################
+    #
+    def target_key(self, instance):
+        """
+        The primary key of the object `instance` refers to, from
+        whichever of the two columns it is in.
+        """
+        key = getattr(instance, self.fk_field)
+        if key is None:
+            key = getattr(instance, self.key_field)
+        return key
+
+    ####################################################################
+    #
+    def instance_pre_init(self, signal, sender, args, kwargs, **_kwargs):
+        """
+        Handles initializing an object with the generic FK instead of
+        content-type/object-id fields.
+        """
+        if self.name in kwargs:
+            value = kwargs.pop(self.name)
+            kwargs[self.ct_field] = self.get_content_type(obj = value)
+            kwargs[self.fk_field] = kwargs[self.key_field] = None
+            kwargs[self.key_attname(value.__class__)] = \
+                self.key_value(value.__class__, value._get_pk_val())
+
+    ####################################################################
+    #
+    def __get__(self, instance, instance_type = None):
+        if instance is None:
+            return self
+
+        try:
+            return getattr(instance, self.cache_attr)
+        except AttributeError:
+            rel_obj = None
+
+            # Use ContentType.objects.get_for_id() so that the content
+            # type lookups are cached.
+            #
+            f = self.model._meta.get_field(self.ct_field)
+            ct_id = getattr(instance, f.get_attname(), None)
+            key = self.target_key(instance)
+            if ct_id and key is not None:
+                ct = self.get_content_type(id = ct_id,
+                                           using = instance._state.db)
+                try:
+                    rel_obj = ct.get_object_for_this_type(pk = key)
+                except ObjectDoesNotExist:
+                    pass
+            setattr(instance, self.cache_attr, rel_obj)
+            return rel_obj
+
+    ####################################################################
+    #
+    def __set__(self, instance, value):
+        if instance is None:
+            raise AttributeError(u"%s must be accessed via instance" %
+                                 self.name)
+
+        ct = None
+        setattr(instance, self.fk_field, None)
+        setattr(instance, self.key_field, None)
+        if value is not None:
+            ct = self.get_content_type(obj = value)
+            setattr(instance, self.key_attname(value.__class__),
+                    self.key_value(value.__class__, value._get_pk_val()))
+        setattr(instance, self.ct_field, ct)
+        setattr(instance, self.cache_attr, value)
@@ -0,0 +1,167 @@
+#
+# File: $Id$
+#
+"""
+Sending the approvals' email.
+
+The same notification usually goes to many approvers. Rather than one
+message with every approver in its To: header, which grows with the
+number of approvers and shows each of them everyone else's address, we
+send one message per batch of at most `APPROVALS_MAIL_BATCH_SIZE`
+(default 50) approvers, who are BCC'd. Messages that are different for
+each recipient, such as reminders, are built by the caller and handed
+to `deliver()`.
+
+Either way every message of a delivery goes over one connection to the
+mail server, opened once, and each message is sent on its own so that
+one failing does not stop the rest. What happened is returned as a
+`DeliveryReport` and failures are logged to the 'approvals.mail'
+logger.
+
+To queue the notifications with django-mailer instead, which does its
+own delivery, see `approvals.notify.MailerNotifier`.
+"""
+
+# Python standard imports
+#
+import logging
+
+# Django imports
+#
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+logger = logging.getLogger('approvals.mail')
+
+####################################################################
+#
+class DeliveryReport(object):
+    """
+    What happened to the messages of a delivery: the number of them
+    that were `sent` and the `failures`, a list of (message, exception)
+    pairs for those that were not.
+    """
+
+    ####################################################################
+    #
+    def __init__(self):
+        self.sent = 0
+        self.failures = []
+
+    ####################################################################
+    #
+    def __unicode__(self):
+        return u"%d sent, %d failed" % (self.sent, len(self.failures))
+
+####################################################################
+#
+class DeliveryError(Exception):
+    """
+    Raised by `send_all()` when none of the messages could be sent. The
+    `report` attribute has the failures.
+    """
+
+    ####################################################################
+    #
+    def __init__(self, report):
+        self.report = report
+        message, error = report.failures[0]
+        super(DeliveryError, self).__init__(
+            "%d of %d messages failed, the first with %s: %s" % (
+                len(report.failures), report.sent + len(report.failures),
+                error.__class__.__name__, error))
+
+####################################################################
+#
+def batches(addresses, size = None):
+    """
+    Split `addresses` into lists of at most `size` of them, by default
+    the `APPROVALS_MAIL_BATCH_SIZE` setting.
+    """
+    if size is None:
+        size = getattr(settings, 'APPROVALS_MAIL_BATCH_SIZE', 50)
+    size = max(size, 1)
+    return [addresses[i:i + size] for i in range(0, len(addresses), size)]
+
+####################################################################
+#
+def bulk_messages(subject, body, addresses, from_email = None, size = None):
+    """
+    Return the messages that send the same email to all of `addresses`,
+    one per batch of them. The batch is BCC'd and the message is
+    addressed to the sender.
+
+    Arguments:
+    - `subject`: The subject of the email.
+    - `body`: The body of the email.
+    - `addresses`: List of the email addresses to send it to.
+    - `from_email`: The sender, DEFAULT_FROM_EMAIL if not given.
+    - `size`: The most addresses in one batch, see `batches()`.
+    """
+    if from_email is None:
+        from_email = settings.DEFAULT_FROM_EMAIL
+    return [EmailMessage(subject, body, from_email, [from_email],
+                         bcc = batch)
+            for batch in batches(addresses, size)]
+
+####################################################################
+#
+def deliver(messages, connection = None):
+    """
+    Send `messages` over one connection, each on its own so that a
+    failure only loses that message. Returns a `DeliveryReport`.
+
+    Arguments:
+    - `messages`: List of EmailMessages to send.
+    - `connection`: The mail backend to use. By default one is got
+                    from Django's EMAIL_BACKEND setting.
+    """
+    report = DeliveryReport()
+    if not messages:
+        return report
+
+    if connection is None:
+        connection = get_connection()
+    opened = connection.open()
+    try:
+        for message in messages:
+            try:
+                report.sent += connection.send_messages([message]) or 0
+            except Exception, e:
+                logger.error("Sending '%s' to %d recipients failed: %s: %s",
+                             message.subject, len(message.recipients()),
+                             e.__class__.__name__, e)
+                report.failures.append((message, e))
+    finally:
+        if opened:
+            connection.close()
+    return report
+
+####################################################################
+#
+def send_all(emails):
+    """
+    Send each of `emails`, a list of (subject, body, addresses)
+    triples, to all of its addresses, in batches, with all of them
+    going over one connection.
+
+    Raises `DeliveryError` if none of it could be sent, so that the
+    outbox will try it again. If only some batches fail, trying again
+    would send the rest twice, so the failures are only logged and
+    returned in the `DeliveryReport`.
+    """
+    messages = []
+    for subject, body, addresses in emails:
+        messages.extend(bulk_messages(subject, body, addresses))
+    report = deliver(messages)
+    if report.failures and not report.sent:
+        raise DeliveryError(report)
+    return report
+
+####################################################################
+#
+def send_to(subject, body, addresses):
+    """
+    Send the same email to all of `addresses`. See `send_all()`.
+    """
+    return send_all([(subject, body, addresses)])
@@ -0,0 +1,76 @@
+#
+# File: $Id: management.py 4 2008-09-15 02:44:56Z scanner $
+#
+"""
+This is part of the management command suite for the approvals module.
+
+Very little happens in here right now. The main purpose is that when
+the 'notification' app is synced we create a notice type for
+'approvals' so that we can create a notice whenever an approval is
+created.
+
+The 'send_approval_reminders' command in 'commands' goes through the
+pending approvals and reminds the approvers that they are still waiting
+for someone to act on them.
+
+On PostgreSQL we also index auth_user's email case insensitively, for
+the registration forms that check that an email address is not
+already in use.
+"""
+from django.db import connections, transaction
+from django.db.models.signals import post_syncdb
+
+# The name of the index on UPPER(email) of auth_user.
+#
+EMAIL_INDEX = 'approvals_auth_user_email_upper'
+
+########################################################################
+#
+def create_email_index(sender, db = 'default', verbosity = 1, **kwargs):
+    """
+    Create an index on UPPER(email) of auth_user, which is what an
+    'email__iexact' lookup compares on PostgreSQL, if it is not there
+    already. Without it checking whether an address is in use scans
+    the whole table. Other databases are left alone.
+
+    The sender is checked by name rather than importing the auth
+    models here, as this module is imported before the models are
+    loaded.
+    """
+    if sender.__name__ != 'django.contrib.auth.models':
+        return
+    connection = connections[db]
+    if connection.settings_dict['ENGINE'].split('.')[-1] not in \
+            ('postgresql', 'postgresql_psycopg2'):
+        return
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1 FROM pg_class WHERE relname = %s",
+                   [EMAIL_INDEX])
+    if cursor.fetchone():
+        return
+    if verbosity >= 1:
+        print "Creating index %s" % EMAIL_INDEX
+    cursor.execute("CREATE INDEX %s ON auth_user (UPPER(email::text))" %
+                   EMAIL_INDEX)
+    transaction.commit_unless_managed(using = db)
+    return
+
+post_syncdb.connect(create_email_index)
+
+########################################################################
+#
+def create_notice_types(sender, **kwargs):
+    """
+    Create the notice type for approvals when django-notification's
+    models are synced, so that `approvals.notify.NotificationNotifier`
+    can send it. The sender is its models module, so nothing is
+    imported here and nothing happens if it is not installed.
+    """
+    if sender.__name__ != 'notification.models':
+        return
+    sender.create_notice_type("pending_approvals", "Pending Approval",
+                              "There is a new action requiring approval.")
+    return
+
+post_syncdb.connect(create_notice_types)
+
@@ -0,0 +1,75 @@
+#
+# File: $Id$
+#
+"""
+Move decided approvals that have not changed in a while out of the live
+approvals table and in to the archive.
+
+The approvals are moved a chunk at a time, each chunk in its own short
+transaction, walking the table in id order. If the command is stopped
+part way through nothing is lost or duplicated and running it again
+simply carries on with what is left.
+"""
+
+# Python standard imports
+#
+import datetime
+import time
+from optparse import make_option
+
+# Django imports
+#
+from django.core.management.base import BaseCommand
+
+# Model imports
+#
+from approvals.models import Approval, ArchivedApproval
+
+####################################################################
+#
+class Command(BaseCommand):
+    help = "Move old decided approvals in to the approvals archive."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days', dest = 'days', type = 'float', default = 90,
+                    help = 'Archive decided approvals that have not been '
+                    'modified for this many days.'),
+        make_option('--chunk-size', dest = 'chunk_size', type = 'int',
+                    default = 1000,
+                    help = 'Number of approvals to move per transaction.'),
+        make_option('--sleep', dest = 'sleep', type = 'float', default = 0,
+                    help = 'Seconds to wait between chunks, to go easy on '
+                    'a busy database.'),
+        )
+
+    ####################################################################
+    #
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        chunk_size = options['chunk_size']
+        cutoff = datetime.datetime.now() - \
+            datetime.timedelta(days = options['days'])
+
+        old = Approval.objects.filter(approved__isnull = False,
+                                      modified__lt = cutoff)
+        total = 0
+        last_id = 0
+        while True:
+            ids = list(old.filter(id__gt = last_id).order_by('id').values_list(
+                    'id', flat = True)[:chunk_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            # `archive()` leaves alone the approvals the outbox still
+            # has work to do for.
+            #
+            total += ArchivedApproval.objects.archive(ids)
+            if verbosity > 1:
+                print "Archived %d approvals, up to id %d" % (total, last_id)
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        if verbosity > 0:
+            print "Archived %d approvals" % total
+        return
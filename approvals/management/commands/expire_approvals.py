@@ -0,0 +1,83 @@
+#
+# File: $Id$
+#
+"""
+Decide the approvals that have been pending for longer than their
+content type's `ApprovalPolicy` allows, denying or approving them as
+the policy says.
+
+The expired approvals are decided a chunk at a time, oldest first,
+each chunk with one UPDATE in its own short transaction and one
+`approvals_acted_on_batch` signal. If the command is stopped part way
+through running it again simply carries on with what is left. Run it
+from cron.
+
+This process never loads the URLConf, so the handlers that act on
+the decisions, such as the ones sending the activation emails of
+approved registrations, come from the modules named by
+`APPROVALS_HANDLER_MODULES` (see `approvals.registry`). They are
+imported before anything is decided.
+"""
+
+# Python standard imports
+#
+import datetime
+from optparse import make_option
+
+# Django imports
+#
+from django.core.management.base import BaseCommand
+
+# Model imports
+#
+from approvals.models import ApprovalPolicy
+
+# Approvals imports
+#
+from approvals.registry import approval_handlers
+
+####################################################################
+#
+class Command(BaseCommand):
+    help = "Deny or approve the approvals that have been pending too long."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', dest = 'chunk_size', type = 'int',
+                    default = 1000,
+                    help = 'Number of approvals to decide per transaction.'),
+        make_option('--sleep', dest = 'sleep', type = 'float', default = 0,
+                    help = 'Seconds to wait between chunks, to go easy on '
+                    'a busy database.'),
+        make_option('--dry-run', dest = 'dry_run', action = 'store_true',
+                    default = False,
+                    help = 'Only count the expired approvals.'),
+        )
+
+    ####################################################################
+    #
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        now = datetime.datetime.now()
+        if not options['dry_run']:
+            approval_handlers.load()
+
+        total = 0
+        for policy in ApprovalPolicy.objects.expiring().select_related(
+                'content_type'):
+            if options['dry_run']:
+                count = policy.expired(now).count()
+            else:
+                count = policy.expire(now, options['chunk_size'],
+                                      options['sleep'])
+            if verbosity > 1:
+                print "%s: %d approvals expired, %s" % (
+                    policy.content_type, count,
+                    policy.get_expire_action_display())
+            total += count
+
+        if verbosity > 0:
+            if options['dry_run']:
+                print "%d approvals have expired" % total
+            else:
+                print "Expired %d approvals" % total
+        return
@@ -0,0 +1,85 @@
+#
+# File: $Id$
+#
+"""
+Export the history of the approvals, live and archived, as CSV or
+JSON lines. See `approvals.export`.
+
+    ./manage.py export_approvals --format jsonl --since 2010-01-01 > out
+
+The export is written as it is read, a chunk at a time, so it can be
+as big as the approvals tables. If it is stopped part way through, the
+'created' and 'id' of the last row written can be given to '--after',
+as 'created,id', to carry on from there.
+"""
+
+# Python standard imports
+#
+import sys
+from optparse import make_option
+
+# Django imports
+#
+from django.core.management.base import BaseCommand, CommandError
+
+# Approvals imports
+#
+from approvals import export
+
+####################################################################
+#
+class Command(BaseCommand):
+    help = "Export the approval history as CSV or JSON lines."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest = 'format', default = 'csv',
+                    choices = sorted(export.FORMATS.keys()),
+                    help = 'csv (the default) or jsonl.'),
+        make_option('--since', dest = 'since', default = None,
+                    help = 'Only approvals created on or after this date '
+                    '(YYYY-MM-DD[ HH:MM:SS]).'),
+        make_option('--until', dest = 'until', default = None,
+                    help = 'Only approvals created before this date.'),
+        make_option('--after', dest = 'after', default = None,
+                    help = "Carry on after the approval with this created "
+                    "time and id, given as 'created,id'."),
+        make_option('--content-type', dest = 'content_types',
+                    action = 'append', default = [],
+                    help = "Only approvals of this 'app_label.model'. May "
+                    "be given more than once."),
+        make_option('--chunk-size', dest = 'chunk_size', type = 'int',
+                    default = 1000,
+                    help = 'Number of approvals to read at a time.'),
+        make_option('--output', dest = 'output', default = None,
+                    help = 'File to write to instead of standard output.'),
+        )
+
+    ####################################################################
+    #
+    def handle(self, *args, **options):
+        since = until = after = content_types = None
+        try:
+            if options['since']:
+                since = export.parse_date(options['since'])
+            if options['until']:
+                until = export.parse_date(options['until'])
+            if options['after']:
+                after = export.parse_cursor(options['after'])
+            if options['content_types']:
+                content_types = export.parse_content_types(
+                    options['content_types'])
+        except ValueError, e:
+            raise CommandError(str(e))
+
+        out = sys.stdout
+        if options['output']:
+            out = open(options['output'], 'wb')
+        try:
+            for line in export.export(options['format'], export.approvals(
+                    since, until, after, content_types,
+                    options['chunk_size'])):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return
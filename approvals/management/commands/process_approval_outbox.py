@@ -0,0 +1,63 @@
+#
+# File: $Id$
+#
+"""
+Deliver the messages queued in the approvals outbox.
+
+Run this from cron, or with '--loop' under a process supervisor, to
+send out the notifications that `Approval.save()` queues instead of
+sending them itself.
+"""
+
+# Python standard imports
+#
+import time
+from optparse import make_option
+
+# Django imports
+#
+from django.core.management.base import BaseCommand
+
+# Model imports
+#
+from approvals.models import OutboxEntry
+
+####################################################################
+#
+class Command(BaseCommand):
+    help = "Deliver the notifications waiting in the approvals outbox."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest = 'batch_size', type = 'int',
+                    default = 100,
+                    help = 'Number of entries to deliver per batch.'),
+        make_option('--loop', dest = 'loop', action = 'store_true',
+                    default = False,
+                    help = 'Keep running, polling the outbox for new '
+                    'entries, instead of exiting once it is empty.'),
+        make_option('--sleep', dest = 'sleep', type = 'float', default = 5.0,
+                    help = 'Seconds to wait between polls when --loop '
+                    'is given and the outbox is empty.'),
+        )
+
+    ####################################################################
+    #
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        verbosity = int(options.get('verbosity', 1))
+
+        while True:
+            delivered, failed = OutboxEntry.objects.deliver_due(batch_size)
+            if verbosity > 1 and (delivered or failed):
+                print "Delivered %d outbox entries, %d failed" % (delivered,
+                                                                  failed)
+
+            # Keep going immediately while there is a full batch worth
+            # of work, otherwise the outbox is drained for now.
+            #
+            if delivered + failed >= batch_size:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+        return
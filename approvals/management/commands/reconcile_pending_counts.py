@@ -0,0 +1,33 @@
+#
+# File: $Id$
+#
+"""
+Recount the pending approvals for each content type and repair the
+counters that have drifted from the approvals table.
+"""
+
+# Django imports
+#
+from django.core.management.base import NoArgsCommand
+
+# Model imports
+#
+from django.contrib.contenttypes.models import ContentType
+from approvals.models import PendingCount
+
+####################################################################
+#
+class Command(NoArgsCommand):
+    help = "Repair the per content type pending approval counters."
+
+    ####################################################################
+    #
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        fixed = PendingCount.objects.reconcile()
+        if verbosity > 0:
+            for ct_id, (old, new) in sorted(fixed.items()):
+                print "%s: %d -> %d" % (ContentType.objects.get_for_id(ct_id),
+                                        old, new)
+            print "Repaired %d pending approval counters" % len(fixed)
+        return
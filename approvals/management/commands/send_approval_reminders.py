@@ -0,0 +1,183 @@
+#
+# File: $Id$
+#
+"""
+Remind the approvers of the approvals that are still waiting for
+someone to act on them.
+
+Every approver gets a single digest listing how many approvals of each
+type they approve are pending along with the oldest few of them.
+Approvers who have already voted on an approval that is still waiting
+for more votes are reminded of it all the same. The pending
+approvals are read a chunk at a time so this runs in bounded memory no
+matter how big the approvals table is, and each approval remembers
+when it was last part of a reminder so running this again only picks
+up the approvals that are due for another one. If the reminder of any
+approver of a content type could not be sent, that type's approvals
+are not recorded as reminded, so the next run tries again.
+"""
+
+# Python standard imports
+#
+import sys
+import datetime
+from optparse import make_option
+
+# Django imports
+#
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+# Model imports
+#
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from approvals.models import Approval
+
+# Approvals imports
+#
+from approvals import mail, notify, recipients
+
+####################################################################
+#
+class Command(BaseCommand):
+    help = "Send each approver a digest of the approvals still pending."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--interval', dest = 'interval', type = 'float',
+                    default = 24,
+                    help = 'Hours to wait before reminding about the same '
+                    'approval again.'),
+        make_option('--min-age', dest = 'min_age', type = 'float',
+                    default = 24,
+                    help = 'Only remind about approvals that have been '
+                    'pending for at least this many hours.'),
+        make_option('--chunk-size', dest = 'chunk_size', type = 'int',
+                    default = 1000,
+                    help = 'Number of approvals to read at a time.'),
+        make_option('--max-listed', dest = 'max_listed', type = 'int',
+                    default = 20,
+                    help = 'Number of approvals of each type to list in '
+                    'a reminder.'),
+        make_option('--dry-run', dest = 'dry_run', action = 'store_true',
+                    default = False,
+                    help = 'Work out the reminders but do not send them '
+                    'or record them as sent.'),
+        )
+
+    ####################################################################
+    #
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        chunk_size = options['chunk_size']
+        max_listed = options['max_listed']
+        now = datetime.datetime.now()
+
+        due = Approval.objects.filter(
+            approved = None,
+            created__lte = now - datetime.timedelta(hours = options['min_age'])
+            ).filter(
+            Q(last_reminded = None) |
+            Q(last_reminded__lte = now -
+              datetime.timedelta(hours = options['interval'])))
+
+        # Walk the due approvals in id order a chunk at a time. We only
+        # keep the count of approvals per content type, the ids of the
+        # first few of each type and the id ranges of the chunks we
+        # read, so memory use does not grow with the number of rows.
+        #
+        counts = {}
+        listed_ids = {}
+        ranges = []
+        last_id = 0
+        while True:
+            first_id = last_id
+            chunk = due.filter(id__gt = last_id).order_by('id').values_list(
+                'id', 'content_type')[:chunk_size]
+            for id, ct_id in chunk.iterator():
+                counts[ct_id] = counts.get(ct_id, 0) + 1
+                listed = listed_ids.setdefault(ct_id, [])
+                if len(listed) < max_listed:
+                    listed.append(id)
+                last_id = id
+            if last_id == first_id:
+                break
+            ranges.append((first_id, last_id))
+
+        if not counts:
+            if verbosity > 1:
+                print "No approvals are due for a reminder"
+            return
+
+        listed_approvals = {}
+        all_listed = sum(listed_ids.values(), [])
+        for approval in Approval.objects.filter(
+                id__in = all_listed).with_targets():
+            listed_approvals.setdefault(approval.content_type_id,
+                                        []).append(approval)
+
+        # Work out which of the content types each approver approves.
+        #
+        approver_cts = {}
+        for ct_id in sorted(counts.keys()):
+            for id in recipients.approver_ids(ct_id):
+                approver_cts.setdefault(id, []).append(ct_id)
+
+        # Build one digest per approver, of just their content types.
+        #
+        site = Site.objects.get_current()
+        messages = []
+        message_cts = []
+        for approver in User.objects.filter(id__in = approver_cts.keys()):
+            if not approver.email:
+                if verbosity > 0:
+                    sys.stderr.write("Not reminding %s, who has no email "
+                                     "address\n" % approver.username)
+                continue
+            ct_ids = approver_cts[approver.id]
+            approval_counts = [(ContentType.objects.get_for_id(ct_id),
+                                counts[ct_id]) for ct_id in ct_ids]
+            approvals = []
+            for ct_id in ct_ids:
+                approvals.extend(listed_approvals.get(ct_id, []))
+            messages.append(notify.reminder_message(approver, approval_counts,
+                                                    approvals, site))
+            message_cts.append(ct_ids)
+
+        if verbosity > 1:
+            print "Reminding %d approvers of %d approvals" % (
+                len(messages), sum(counts.values()))
+        if options['dry_run']:
+            return
+
+        # Send all of the digests over the one connection.
+        #
+        report = mail.deliver(messages)
+        if verbosity > 1:
+            print "Sent %d reminders" % report.sent
+        for message, error in report.failures:
+            sys.stderr.write("Reminding %s failed: %s: %s\n" % (
+                    ', '.join(message.to), error.__class__.__name__, error))
+
+        # The content types that some approver was not reminded of.
+        #
+        failed = [message for message, error in report.failures]
+        failed_cts = set()
+        for message, ct_ids in zip(messages, message_cts):
+            if message in failed:
+                failed_cts.update(ct_ids)
+
+        # Now that the reminders have gone out, record that these
+        # approvals were part of one, leaving the approvals of the
+        # content types whose reminders failed to be reminded about
+        # next time. This is done a chunk at a time as well so we do
+        # not hold locks on the whole table.
+        #
+        reminded = due
+        if failed_cts:
+            reminded = due.exclude(content_type__in = failed_cts)
+        for first_id, last_id in ranges:
+            reminded.filter(id__gt = first_id,
+                            id__lte = last_id).update(last_reminded = now)
+        return
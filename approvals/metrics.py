@@ -0,0 +1,278 @@
+#
+# File: $Id$
+#
+"""
+Timings and other numbers about the approvals life cycle.
+
+Approvals reports how long it spends saving and deciding approvals,
+rendering and sending notifications, in each receiver of its signals
+and in its views, along with how many queries each of those made, and
+how long each approval waited for its decision. Where those numbers go
+is up to the backend named by the `APPROVALS_METRICS_BACKEND` setting:
+
+- 'approvals.metrics.NullMetrics', the default, throws them away.
+- 'approvals.metrics.LoggingMetrics' logs them to the
+  'approvals.metrics' logger.
+- 'approvals.metrics.StatsdMetrics' sends them to statsd, at
+  `APPROVALS_STATSD_HOST` (default 'localhost') and
+  `APPROVALS_STATSD_PORT` (default 8125), with every name prefixed by
+  `APPROVALS_STATSD_PREFIX` (default none).
+
+Any other class with the same methods as NullMetrics works too. Query
+counts come from Django's list of the queries it has run, which it
+only keeps when DEBUG is on; otherwise they are reported as None.
+"""
+
+# Python standard imports
+#
+import time
+import socket
+import logging
+from functools import wraps
+
+# Django imports
+#
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+from django.dispatch.dispatcher import _make_id
+
+# Model imports
+#
+from django.contrib.contenttypes.models import ContentType
+
+# Approvals imports
+#
+from approvals import backends
+
+####################################################################
+#
+class NullMetrics(object):
+    """
+    The metrics backend that does nothing. It also documents the
+    methods a metrics backend has.
+    """
+
+    ####################################################################
+    #
+    def timing(self, name, seconds, queries = None):
+        """
+        Record that the stage `name` took `seconds` and made `queries`
+        queries, which is None if they were not counted.
+        """
+        pass
+
+    ####################################################################
+    #
+    def histogram(self, name, value):
+        """
+        Record one observation of `value` in the distribution `name`.
+        """
+        pass
+
+####################################################################
+#
+class LoggingMetrics(NullMetrics):
+    """
+    Log metrics at INFO level to the 'approvals.metrics' logger.
+    """
+
+    ####################################################################
+    #
+    def __init__(self):
+        self.logger = logging.getLogger('approvals.metrics')
+
+    ####################################################################
+    #
+    def timing(self, name, seconds, queries = None):
+        self.logger.info("%s: %.1fms, %s queries", name, seconds * 1000,
+                         queries)
+
+    ####################################################################
+    #
+    def histogram(self, name, value):
+        self.logger.info("%s: %s", name, value)
+
+####################################################################
+#
+class StatsdMetrics(NullMetrics):
+    """
+    Send metrics to statsd over UDP. Timings are sent in milliseconds,
+    with the query count as the histogram '<name>.queries'. Nothing is
+    waited on and errors sending are ignored, so statsd going away
+    does not affect the approvals.
+    """
+
+    ####################################################################
+    #
+    def __init__(self):
+        self.address = (getattr(settings, 'APPROVALS_STATSD_HOST',
+                                'localhost'),
+                        getattr(settings, 'APPROVALS_STATSD_PORT', 8125))
+        self.prefix = getattr(settings, 'APPROVALS_STATSD_PREFIX', '')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    ####################################################################
+    #
+    def send(self, name, value, kind):
+        """
+        Send one statsd line.
+        """
+        try:
+            self.socket.sendto("%s%s:%s|%s" % (self.prefix, name, value,
+                                               kind), self.address)
+        except socket.error:
+            pass
+
+    ####################################################################
+    #
+    def timing(self, name, seconds, queries = None):
+        self.send(name, "%.3f" % (seconds * 1000), 'ms')
+        if queries is not None:
+            self.send(name + '.queries', queries, 'h')
+
+    ####################################################################
+    #
+    def histogram(self, name, value):
+        self.send(name, value, 'h')
+
+####################################################################
+#
+def get_backend():
+    """
+    The metrics backend named by the `APPROVALS_METRICS_BACKEND`
+    setting (see `approvals.backends`).
+    """
+    return backends.get_backend('APPROVALS_METRICS_BACKEND',
+                                'approvals.metrics.NullMetrics')
+
+####################################################################
+#
+def query_count():
+    """
+    The number of queries made so far, if DEBUG is on so that Django is
+    keeping count, otherwise None.
+    """
+    if settings.DEBUG:
+        return len(connection.queries)
+    return None
+
+####################################################################
+#
+class timer(object):
+    """
+    Context manager that reports how long its block took, and how many
+    queries it made, as the timing `name`:
+
+        with timer('approvals.notify.render'):
+            ...
+    """
+
+    ####################################################################
+    #
+    def __init__(self, name):
+        self.name = name
+
+    ####################################################################
+    #
+    def __enter__(self):
+        self.queries = query_count()
+        self.start = time.time()
+        return self
+
+    ####################################################################
+    #
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.time() - self.start
+        queries = None
+        if self.queries is not None:
+            # The count can go down if the queries are reset, say by a
+            # request starting, part way through.
+            #
+            queries = max(len(connection.queries) - self.queries, 0)
+        get_backend().timing(self.name, elapsed, queries)
+        return False
+
+####################################################################
+#
+def timed(name):
+    """
+    Decorator reporting how long each call of the decorated function
+    takes as the timing `name`.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+####################################################################
+#
+def receiver_name(receiver):
+    """
+    The name we report a signal receiver's timing under.
+    """
+    return "%s.%s" % (getattr(receiver, '__module__', None),
+                      getattr(receiver, '__name__',
+                              receiver.__class__.__name__))
+
+####################################################################
+#
+class TimedSignal(Signal):
+    """
+    A Signal that reports how long each of its receivers takes, as the
+    timing 'approvals.receivers.<signal name>.<receiver>'.
+    """
+
+    ####################################################################
+    #
+    def __init__(self, name, providing_args = None):
+        super(TimedSignal, self).__init__(providing_args)
+        self.name = name
+
+    ####################################################################
+    #
+    def send(self, sender, **named):
+        """
+        The same as `Signal.send()` except that each receiver is timed.
+        """
+        responses = []
+        if not self.receivers:
+            return responses
+
+        for receiver in self._live_receivers(_make_id(sender)):
+            with timer("approvals.receivers.%s.%s" % (
+                    self.name, receiver_name(receiver))):
+                response = receiver(signal = self, sender = sender, **named)
+            responses.append((receiver, response))
+        return responses
+
+####################################################################
+#
+def record_decisions(approvals):
+    """
+    Report how long each of the given, just decided, approvals waited
+    for its decision, in seconds, in the histogram
+    'approvals.time_to_decision.<app label>.<model>' for the content
+    type of the approval.
+
+    The wait is measured to the approval's 'modified' time, which is
+    set with the decision, because 'when_acted_on' is in UTC while
+    'created' is in local time.
+
+    Arguments:
+    - `approvals`: A list of Approval objects.
+    """
+    backend = get_backend()
+    if backend.__class__ is NullMetrics:
+        return
+    for approval in approvals:
+        ct = ContentType.objects.get_for_id(approval.content_type_id)
+        wait = approval.modified - approval.created
+        backend.histogram("approvals.time_to_decision.%s.%s" % (
+                ct.app_label, ct.model),
+                          wait.days * 86400 + wait.seconds +
+                          wait.microseconds / 1000000.0)
+    return
@@ -3,52 +3,686 @@
 #
 
 # Python standard imports
+import sys
 import datetime
+import time
+from itertools import islice
 
 # Django imports
 #
 from django.conf import settings
-from django.db import models
-from django.db.models import permalink
-from django.template.loader import render_to_string
+from django.core.cache import cache
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Count, F, Q, permalink
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db.models.query import QuerySet, ITER_CHUNK_SIZE
+from django.utils import simplejson
 from django.utils.translation import ugettext_lazy as _
-import django.dispatch
 
 # Model imports
 #
-from django.contrib.auth.models import User
-from django.contrib.sites.models import Site
+from django.contrib.auth.models import Group, User
 from django.contrib.contenttypes.models import ContentType
-from django.contrib.contenttypes import generic
 
-# If the django-notification app is present then import and we will use this
-# instead of sending email directly.
+# Approvals imports
 #
-try:
-    from notification import models as notification
-except ImportError:
-    notification = None
-
-# favour django-mailer but fall back to django.core.mail
-try:
-    from mailer import send_mail
-except ImportError:
-    from django.core.mail import send_mail
+from approvals import metrics, notify, recipients
+from approvals.fields import TargetForeignKey
+from approvals.registry import approval_handlers
+from approvals.utils import atomic
 
 # We define a signal that is invoked whenever an Approval object
 # is acted upon (by calling its 'approve()' method.
 #
-approval_acted_on = django.dispatch.Signal()
+# Both signals report how long each of their receivers takes to the
+# metrics backend (see `approvals.metrics`.)
+#
+approval_acted_on = metrics.TimedSignal('approval_acted_on')
+
+# When many approvals are decided at once (see
+# `ApprovalQuerySet.decide()`) this signal is sent once for the whole
+# lot, with the list of Approval objects that were decided as the
+# 'approvals' argument, instead of `approval_acted_on` being sent for
+# each of them.
+#
+approvals_acted_on_batch = metrics.TimedSignal('approvals_acted_on_batch',
+                                               providing_args = ['approvals'])
+
+# Pass decisions on to the handlers registered for the model of the
+# approval (see `approvals.registry`). This is done here, and not
+# where the handlers are registered, so that every process that sends
+# the signals, including the outbox worker and the management
+# commands, runs the handlers.
+#
+approval_acted_on.connect(approval_handlers.dispatch,
+                          dispatch_uid = 'approvals.registry.dispatch')
+approvals_acted_on_batch.connect(
+    approval_handlers.dispatch_batch,
+    dispatch_uid = 'approvals.registry.dispatch_batch')
+
+# Keep the cached set of approvers (see `approvals.recipients`) up to
+# date as users and their group memberships change.
+#
+post_save.connect(recipients.user_changed, sender = User)
+post_delete.connect(recipients.user_changed, sender = User)
+post_delete.connect(recipients.invalidate, sender = Group)
+m2m_changed.connect(recipients.invalidate, sender = User.groups.through)
 
 ####################################################################
 #
-class Approval(models.Model):
+def defer_actions():
     """
-    This object represents some other object in the database
+    True if the `APPROVALS_DEFER_ACTIONS` setting says that the
+    `approval_acted_on` and `approvals_acted_on_batch` signals should be
+    sent by the outbox worker, after the decision has been committed,
+    instead of by whoever made the decision.
+    """
+    return getattr(settings, 'APPROVALS_DEFER_ACTIONS', False)
+
+####################################################################
+#
+def decision_values(approval_status, approver, reason = None):
+    """
+    Return a dictionary of the column values that record a decision on
+    an approval, suitable for passing to `QuerySet.update()`. Since
+    `update()` does not honour `auto_now` we set `modified` here too.
+
+    Arguments:
+    - `approval_status`: Boolean - is this approved or not.
+    - `approver`: User - the user that is acting on the approval.
+    - `reason`: Optional reason for the decision.
+    """
+    values = { 'approved'      : approval_status,
+               'acted_on_by'   : approver,
+               'when_acted_on' : datetime.datetime.utcnow(),
+               'modified'      : datetime.datetime.now() }
+    if reason:
+        values['reason'] = reason
+    return values
+
+####################################################################
+#
+def prefetch_targets(approvals, querysets = None):
+    """
+    Fill in the `needs_approval` generic foreign key of all of the
+    given approvals with one `in_bulk()` query per content type,
+    instead of the two queries per approval that accessing
+    `needs_approval` on each of them would cost.
+
+    The objects of each model are fetched from the queryset given for
+    it in `querysets`, or else the one registered with
+    `approval_handlers.register_targets()` (see `approvals.registry`),
+    or else its default manager. That way the objects can come with
+    what their `__unicode__()` shows already joined in with
+    `select_related()`, instead of it costing a query per object.
+
+    Approvals whose target no longer exists get None, just as they
+    would from the generic foreign key itself.
+
+    Arguments:
+    - `approvals`: A list of Approval objects.
+    - `querysets`: Optional dictionary mapping model classes to the
+                   querysets to fetch their objects from.
+    """
+    target = Approval.needs_approval
+    cache_attr = target.cache_attr
+    pks_by_ct = {}
+    for approval in approvals:
+        if not hasattr(approval, cache_attr):
+            pks_by_ct.setdefault(approval.content_type_id,
+                                 set()).add(target.target_key(approval))
+
+    targets = {}
+    for ct_id, pks in pks_by_ct.iteritems():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        if model is None:
+            # The model for this content type has gone away.
+            #
+            continue
+        if querysets is not None and model in querysets:
+            queryset = querysets[model]
+        else:
+            queryset = approval_handlers.targets_for(model)
+        for pk, obj in queryset.in_bulk(list(pks)).iteritems():
+            targets[(ct_id, target.key_value(model, pk))] = obj
+
+    for approval in approvals:
+        if not hasattr(approval, cache_attr):
+            setattr(approval, cache_attr,
+                    targets.get((approval.content_type_id,
+                                 target.target_key(approval))))
+    return approvals
+
+####################################################################
+#
+class TargetQuerySet(QuerySet):
+    """
+    QuerySet for Approval and ArchivedApproval objects that can fetch
+    the objects the approvals are for in bulk.
+    """
+
+    ####################################################################
+    #
+    def __init__(self, *args, **kwargs):
+        super(TargetQuerySet, self).__init__(*args, **kwargs)
+        self._prefetch_targets = False
+        self._target_querysets = None
+
+    ####################################################################
+    #
+    def with_targets(self, querysets = None):
+        """
+        Return a copy of this queryset that, as it is evaluated, fetches
+        the `needs_approval` objects for each chunk of approvals with
+        one query per content type. It also joins in `acted_on_by` and
+        `content_type`.
+
+        This turns the 2N+1 queries of listing approvals along with
+        what they are for in to a handful.
+
+        Arguments:
+        - `querysets`: Optional dictionary mapping model classes to the
+                       querysets to fetch their objects from, as for
+                       `prefetch_targets()`.
+        """
+        clone = self.select_related('acted_on_by', 'content_type')
+        clone._prefetch_targets = True
+        clone._target_querysets = querysets
+        return clone
+
+    ####################################################################
+    #
+    def _clone(self, klass = None, setup = False, **kwargs):
+        clone = super(TargetQuerySet, self)._clone(klass, setup, **kwargs)
+        clone._prefetch_targets = self._prefetch_targets
+        clone._target_querysets = self._target_querysets
+        return clone
+
+    ####################################################################
+    #
+    def iterator(self):
+        results = super(TargetQuerySet, self).iterator()
+        if not self._prefetch_targets:
+            return results
+        return self._iterator_with_targets(results)
+
+    ####################################################################
+    #
+    def _iterator_with_targets(self, results):
+        """
+        Consume `results` a chunk at a time, prefetching the targets of
+        each chunk before handing its approvals on.
+        """
+        while True:
+            chunk = list(islice(results, ITER_CHUNK_SIZE))
+            if not chunk:
+                return
+            prefetch_targets(chunk, self._target_querysets)
+            for approval in chunk:
+                yield approval
+
+####################################################################
+#
+class ApprovalQuerySet(TargetQuerySet):
+    """
+    QuerySet for Approval objects that can also decide many approvals
+    at once.
+    """
+
+    # The most ids we put in a single 'id IN (...)' in `decide()`.
+    #
+    DECIDE_BATCH_SIZE = 500
+
+    ####################################################################
+    #
+    @metrics.timed('approvals.decide')
+    @atomic
+    def decide(self, approval_status, approver, reason = None):
+        """
+        Approve or deny all of the approvals in this queryset that have
+        not been acted on yet, in one transaction with a single UPDATE,
+        and then send the `approvals_acted_on_batch` signal with the
+        approvals that were decided.
+
+        Approvals that are already processed, including ones that
+        someone else decides while we are working, are left alone.
+
+        Returns the list of approvals that this call decided.
+
+        Arguments:
+        - `approval_status`: Boolean - are these approved or not.
+        - `approver`: User - the user that is acting on these approvals.
+        - `reason`: A string to set as the reason for accepting or denying
+                    these approval requests.
+        """
+        ids = list(self.filter(approved = None).values_list('id', flat = True))
+        if not ids:
+            return []
+
+        values = decision_values(approval_status, approver, reason)
+
+        # The 'approved = None' condition is repeated so that we do not
+        # overwrite a decision made since we read the ids. The id list
+        # is only split up when it is too long for a single statement
+        # on SQLite.
+        #
+        # Each batch is read back straight away to get the ones we
+        # actually decided, which are the ones carrying our timestamp.
+        # Their targets are not fetched here; receivers that need them
+        # can use `prefetch_targets()`.
+        #
+        qs = Approval.objects.filter(approved = None)
+        approvals = []
+        for start in range(0, len(ids), self.DECIDE_BATCH_SIZE):
+            batch = ids[start:start + self.DECIDE_BATCH_SIZE]
+            qs.filter(id__in = batch).update(**values)
+            approvals.extend(Approval.objects.filter(
+                    id__in = batch,
+                    when_acted_on = values['when_acted_on']).select_related(
+                    'acted_on_by'))
+        if approval_status is not None:
+            decided = {}
+            for approval in approvals:
+                decided[approval.content_type_id] = \
+                    decided.get(approval.content_type_id, 0) + 1
+            for ct_id, n in decided.iteritems():
+                PendingCount.objects.adjust(ct_id, -n)
+            metrics.record_decisions(approvals)
+        if approvals:
+            if defer_actions():
+                OutboxEntry.objects.create(
+                    kind = OutboxEntry.ACTED_ON_BATCH,
+                    payload = simplejson.dumps([a.id for a in approvals]))
+            else:
+                approvals_acted_on_batch.send(sender = Approval,
+                                              approvals = approvals)
+        return approvals
+
+    ####################################################################
+    #
+    def vote(self, approval_status, approver, reason = None):
+        """
+        Cast `approver`'s vote on all of the approvals in this queryset
+        that have not been acted on yet, honouring the quorum of their
+        `ApprovalPolicy`s.
+
+        Approvals of content types whose policy needs more than one
+        approver are voted on one at a time with `Approval.vote()`.
+        The rest are decided by a single vote, so they are decided
+        together with `decide()`.
+
+        Returns a tuple of the list of approvals that were decided and
+        the list of approvals that the vote was counted for but that
+        are still waiting for other approvers.
+
+        Arguments:
+        - `approval_status`: Boolean - approve these or not.
+        - `approver`: User - the user that is voting.
+        - `reason`: A string to give as the reason for the votes.
+        """
+        pending = self.filter(approved = None)
+        ct_ids = set(pending.values_list('content_type', flat = True))
+        if not ct_ids:
+            return [], []
+
+        voted_cts = list(ApprovalPolicy.objects.filter(
+                content_type__in = ct_ids,
+                quorum__gt = 1).values_list('content_type', flat = True))
+        if not voted_cts:
+            return pending.decide(approval_status, approver, reason), []
+
+        decided = pending.exclude(content_type__in = voted_cts).decide(
+            approval_status, approver, reason)
+        waiting = []
+        for approval in pending.filter(content_type__in = voted_cts):
+            if not approval.vote(approval_status, approver, reason):
+                continue
+            if approval.processed():
+                decided.append(approval)
+            else:
+                waiting.append(approval)
+        return decided, waiting
 
-    XXX Right now we assume that the people that need to approve something
-        must have the is_staff bit set. We should make it so that you can
-        specify a list of who is allowed to approve something.
+####################################################################
+#
+class ApprovalManager(models.Manager):
+    """
+    Manager for Approval objects with helpers for working with many
+    approvals at once.
+    """
+
+    ####################################################################
+    #
+    def get_query_set(self):
+        return ApprovalQuerySet(self.model, using = self._db)
+
+    ####################################################################
+    #
+    def with_targets(self, querysets = None):
+        """
+        See `ApprovalQuerySet.with_targets()`.
+        """
+        return self.get_query_set().with_targets(querysets)
+
+    # How many rows go in to a single multi-row INSERT. SQLite limits
+    # a statement to 999 parameters so this needs to stay under that
+    # divided by the number of columns we insert.
+    #
+    INSERT_BATCH_SIZE = 200
+
+    ####################################################################
+    #
+    def history_for(self, obj):
+        """
+        Return the list of all approvals for `obj`, oldest first,
+        including the ones that have been moved to the archive.
+
+        Arguments:
+        - `obj`: The model instance to get the approvals for.
+        """
+        lookup = Approval.needs_approval.lookup(obj.__class__,
+                                                [obj._get_pk_val()])
+        lookup['content_type'] = ContentType.objects.get_for_model(obj)
+        history = list(ArchivedApproval.objects.filter(**lookup)) + \
+            list(self.filter(**lookup))
+        history.sort(key = lambda a: (a.created, a.id))
+        return history
+
+    ####################################################################
+    #
+    def status_map(self, objects):
+        """
+        Return a dictionary mapping each of the given objects to its
+        most recent approval, or None if it has never needed one. This
+        costs one query per model among the objects, plus one against
+        the archive for the objects of that model that have no live
+        approvals, all served by the (content_type_id, object_id) and
+        (content_type_id, object_key) indexes created from the 'sql'
+        directory.
+
+        Arguments:
+        - `objects`: An iterable of model instances.
+        """
+        objs_by_model = {}
+        for obj in objects:
+            objs_by_model.setdefault(obj.__class__, []).append(obj)
+
+        target = Approval.needs_approval
+        statuses = {}
+        for model, objs in objs_by_model.iteritems():
+            content_type = ContentType.objects.get_for_model(model)
+            by_pk = dict([(target.key_value(model, obj._get_pk_val()), obj)
+                          for obj in objs])
+            latest = {}
+            for manager in (self, ArchivedApproval.objects):
+                missing = [pk for pk in by_pk if pk not in latest]
+                if not missing:
+                    break
+                for approval in manager.filter(
+                        content_type = content_type,
+                        **target.lookup(model, missing)).order_by('created',
+                                                                  'id'):
+                    latest[target.target_key(approval)] = approval
+            for pk, obj in by_pk.iteritems():
+                approval = latest.get(pk)
+                if approval is not None:
+                    setattr(approval, Approval.needs_approval.cache_attr, obj)
+                statuses[obj] = approval
+        return statuses
+
+    ####################################################################
+    #
+    def pending(self, content_types = None, approver = None):
+        """
+        Return a queryset of the approvals that have not been acted on
+        yet, oldest first.
+
+        If an `approver` is given this is their inbox: just the
+        approvals they may act on (see `approvals.recipients`) that they
+        have not voted on yet.
+
+        Arguments:
+        - `content_types`: Optional list of ContentTypes, or their ids,
+                           to restrict the approvals to. We filter on
+                           the ids directly so there is no join to the
+                           content types table.
+        - `approver`: Optional User whose inbox this is.
+        """
+        qs = self.filter(approved = None)
+        if content_types is not None:
+            ct_ids = [getattr(ct, 'id', ct) for ct in content_types]
+            qs = qs.filter(content_type__in = ct_ids)
+        if approver is not None:
+            qs = qs.filter(recipients.approvable_by(approver)).exclude(
+                id__in = ApprovalVote.objects.filter(
+                    user = approver).values('approval_id'))
+        return qs.order_by('created', 'id')
+
+    ####################################################################
+    #
+    def inbox(self, approver):
+        """
+        The pending approvals waiting on `approver`, oldest first. The
+        same as `pending(approver = approver)`.
+        """
+        return self.pending(approver = approver)
+
+    ####################################################################
+    #
+    def pending_page(self, content_types = None, after = None,
+                     per_page = 20, approver = None):
+        """
+        Return one page of the pending approval queue using keyset
+        pagination on (created, id). Unlike OFFSET pagination every page
+        costs the same no matter how deep in to the queue it is, and no
+        COUNT(*) of the queue is needed.
+
+        This is backed by the (approved, content_type_id, created, id)
+        index created from 'sql/approval.sql'.
+
+        Returns a tuple of the list of approvals on this page and the
+        (created, id) cursor for the next page, or None if this is the
+        last page.
+
+        Arguments:
+        - `content_types`: As for `pending()`.
+        - `after`: The (created, id) cursor returned for the previous
+                   page, or None for the first page.
+        - `per_page`: The maximum number of approvals on a page.
+        - `approver`: As for `pending()`.
+        """
+        qs = self.pending(content_types, approver).with_targets()
+        if after is not None:
+            created, id = after
+            qs = qs.filter(Q(created__gt = created) |
+                           Q(created = created, id__gt = id))
+
+        # Fetch one extra row so we know if there is a next page.
+        #
+        approvals = list(qs[:per_page + 1])
+        next_cursor = None
+        if len(approvals) > per_page:
+            approvals = approvals[:per_page]
+            next_cursor = (approvals[-1].created, approvals[-1].id)
+        return (approvals, next_cursor)
+
+    ####################################################################
+    #
+    def _pending_keys(self, content_type, model, pks):
+        """
+        Return a dictionary mapping the keys, as stored by
+        `needs_approval`, of those of the given objects that have a
+        pending approval to that approval.
+
+        Arguments:
+        - `content_type`: The ContentType of `model`.
+        - `model`: The model class of the objects.
+        - `pks`: A list of their primary keys.
+        """
+        target = self.model.needs_approval
+        return dict([(target.target_key(approval), approval) for approval in
+                     self.filter(approved = None, content_type = content_type,
+                                 **target.lookup(model, pks))])
+
+    ####################################################################
+    #
+    @atomic
+    def request_approval(self, obj):
+        """
+        Ask for approval of `obj` unless it is already waiting for
+        one. Returns a tuple of the pending Approval and whether it was
+        created, like `get_or_create()`. The new approval notification
+        is only queued when the approval is created, so calling this
+        again for the same object (a retried request, a form submitted
+        twice) neither creates a second approval nor bothers the
+        approvers twice.
+
+        Two requests racing to create the approval are settled by the
+        unique partial indexes in 'approvals/sql/' that allow only one
+        pending approval per object: the loser's INSERT fails and it
+        returns the winner's approval instead. Any other IntegrityError,
+        or one for which no pending approval turns up, is raised.
+        Backends without partial indexes (MySQL) only get the check
+        made before the INSERT.
+
+        Arguments:
+        - `obj`: The model instance that needs approval.
+        """
+        content_type = ContentType.objects.get_for_model(obj)
+        model, pk = obj.__class__, obj._get_pk_val()
+        key = self.model.needs_approval.key_value(model, pk)
+
+        existing = self._pending_keys(content_type, model, [pk])
+        if key in existing:
+            return (existing[key], False)
+
+        approval = self.model(needs_approval = obj)
+        sid = transaction.savepoint()
+        try:
+            approval.save()
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            existing = self._pending_keys(content_type, model, [pk])
+            if key not in existing:
+                # Not the unique pending index, or the approval that
+                # beat us has been decided already.
+                #
+                raise
+            return (existing[key], False)
+        return (approval, True)
+
+    ####################################################################
+    #
+    @atomic
+    def request_many(self, objects):
+        """
+        Create a pending Approval for each of the given objects using
+        multi-row INSERTs, and queue a single digest notification for
+        the whole lot instead of one notification per approval.
+
+        Objects that already have a pending approval, and repeats in
+        `objects`, are skipped, so like `request_approval()` this is
+        safe to call again with the same objects.
+
+        Unlike `Approval.save()` this does not send the `post_save`
+        signal for the approvals it creates.
+
+        Returns a dictionary mapping each ContentType to the number of
+        approvals created for it.
+
+        Arguments:
+        - `objects`: An iterable of model instances that need approval.
+        """
+        target = self.model.needs_approval
+
+        # Group the primary keys by model so that we only look up the
+        # content type for each model once.
+        #
+        pks_by_model = {}
+        seen = set()
+        for obj in objects:
+            model = obj.__class__
+            pk = obj._get_pk_val()
+            key = (model, target.key_value(model, pk))
+            if key in seen:
+                continue
+            seen.add(key)
+            pks_by_model.setdefault(model, []).append(pk)
+
+        now = datetime.datetime.now()
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        stamp = connection.ops.value_to_db_datetime(now)
+        counts = {}
+        cursor = connection.cursor()
+        for model, pks in pks_by_model.iteritems():
+            content_type = ContentType.objects.get_for_model(model)
+            columns = [opts.get_field(name).column for name in
+                       ('content_type', target.key_attname(model),
+                        'created', 'modified')]
+            created = 0
+            for start in range(0, len(pks), self.INSERT_BATCH_SIZE):
+                chunk = pks[start:start + self.INSERT_BATCH_SIZE]
+
+                # If someone else creates approvals for some of the
+                # chunk between our check and our INSERT, the INSERT
+                # fails on the unique pending index and we check
+                # again. The chunk only gets smaller each time; if
+                # checking again does not shrink it the INSERT failed
+                # for some other reason and we raise that error.
+                #
+                error = None
+                while chunk:
+                    pending = self._pending_keys(content_type, model, chunk)
+                    remaining = [obj_pk for obj_pk in chunk
+                                 if target.key_value(model, obj_pk)
+                                 not in pending]
+                    if error is not None and len(remaining) == len(chunk):
+                        raise error[0], error[1], error[2]
+                    chunk = remaining
+                    if not chunk:
+                        break
+                    params = []
+                    for pk in chunk:
+                        params.extend((content_type.id,
+                                       target.key_value(model, pk),
+                                       stamp, stamp))
+                    sid = transaction.savepoint()
+                    try:
+                        cursor.execute("INSERT INTO %s (%s) VALUES %s" % (
+                                qn(opts.db_table),
+                                ", ".join([qn(c) for c in columns]),
+                                ", ".join(["(%s, %s, %s, %s)"] * len(chunk))),
+                                       params)
+                        transaction.savepoint_commit(sid)
+                    except IntegrityError:
+                        error = sys.exc_info()
+                        transaction.savepoint_rollback(sid)
+                        continue
+                    created += len(chunk)
+                    break
+            if created:
+                counts[content_type] = created
+                PendingCount.objects.adjust(content_type.id, created)
+        transaction.set_dirty()
+
+        if counts:
+            payload = dict([(str(ct.id), n) for ct, n in counts.iteritems()])
+            OutboxEntry.objects.create(kind = OutboxEntry.DIGEST,
+                                       payload = simplejson.dumps(payload))
+        return counts
+
+####################################################################
+#
+class ApprovalBase(models.Model):
+    """
+    The fields and methods shared by live approvals, `Approval`, and
+    decided approvals that have been moved out of the way in to the
+    archive, `ArchivedApproval`.
+
+    The `needs_approval` generic foreign key is declared on each of the
+    subclasses as abstract models do not pass those on.
     """
     approved = models.NullBooleanField(_('approved'), null = True,
                                        help_text = _("Has the 'needs_approval' "
@@ -69,20 +703,28 @@ class Approval(models.Model):
                               help_text = _("When an object is approved or "
                               "disapproved the person doing the action "
                               "can supply some reason here."))
+    last_reminded = models.DateTimeField(_('last reminded'), null = True,
+                                         blank = True,
+                                         help_text = _("When the approvers "
+                                         "were last reminded that this "
+                                         "approval is still pending."))
 
-    # The generic foreign key relation. These three fields let us
-    # relate an Approval object to any other model out there
-    # XXX As long as that other model uses an integer as its primary
-    #     key due to the type of 'object_id'
+    # The generic foreign key relation. These fields, along with the
+    # `needs_approval` generic foreign key declared on the subclasses,
+    # let us relate an Approval object to any other model out
+    # there. The primary key of the other model goes in 'object_id'
+    # if it is an integer and in 'object_key', as a string, if it is
+    # anything else (see approvals.fields.TargetForeignKey.)
     #
     content_type = models.ForeignKey(ContentType,
                                      verbose_name = _("content type"))
-    object_id = models.PositiveIntegerField(_('object id'))
-    needs_approval = generic.GenericForeignKey('content_type', 'object_id')
+    object_id = models.PositiveIntegerField(_('object id'), null = True,
+                                            blank = True)
+    object_key = models.CharField(_('object key'), max_length = 64,
+                                  null = True, blank = True)
 
     class Meta:
-        verbose_name = _('approval')
-        verbose_name_plural = _('approvals')
+        abstract = True
         ordering = ['created']
 
     ####################################################################
@@ -106,70 +748,83 @@ class Approval(models.Model):
         """
         return ("approvals_act_on", [str(self.id)])
 
+    ##################################################################
+    #
+    def processed(self):
+        """
+        A helper method that tells you whether or not this approval
+        has already been acted on. Most UI's are going to want an
+        approval to only be acted on once.
+        """
+        return self.approved is not None
+
+####################################################################
+#
+class Approval(ApprovalBase):
+    """
+    This object represents some other object in the database
+
+    Who may approve it is set by the `ApprovalPolicy` for the content
+    type of that object. If there is no policy, or it has no approvers
+    assigned, the is_staff users approve it.
+    """
+    needs_approval = TargetForeignKey('content_type', 'object_id',
+                                      'object_key')
+
+    objects = ApprovalManager()
+
+    class Meta:
+        verbose_name = _('approval')
+        verbose_name_plural = _('approvals')
+        ordering = ['created']
+
     ####################################################################
     #
+    @metrics.timed('approvals.save')
     def save(self, force_insert = False, force_update = False):
         """
         We override the `save()` method so that when an Approval is
-        being saved for the first time we can send a message to the
-        is_staff members that there is a new item requiring their
-        attention.
+        being saved for the first time we can let the is_staff members
+        know that there is a new item requiring their attention.
+
+        We do not send that message here. Instead an `OutboxEntry` is
+        written in the same transaction as the Approval and the
+        'process_approval_outbox' management command delivers it. This
+        way whoever is creating the approval does not wait on the mail
+        server, and if the transaction is rolled back no message about
+        a non-existent approval goes out.
 
         Arguments:
 
         - `force_insert`: - passed through to the parent class method
         - `force_update`: - passed through to the parent class method
         """
-
-        # We send our notification to the staff after we have saved
-        # the approval for the first time, we need an id to construct
-        # the URL for it.
-        #
         if self.id is None:
-            new = True
+            self._save_new(force_insert, force_update)
         else:
-            new = False
+            super(Approval, self).save(force_insert, force_update)
+        return
 
+    ####################################################################
+    #
+    @atomic
+    def _save_new(self, force_insert, force_update):
+        """
+        Insert a new Approval along with the outbox entry that will
+        tell the approvers about it. We need the approval's id before
+        we can queue the entry which is why this happens after the
+        insert.
+        """
         super(Approval, self).save(force_insert, force_update)
-
-        if new:
-            # Now we send an email message to our site admins. If we have
-            # the django-notification app installed use that to send
-            # the message out (because it also creates notification
-            # objects.) Otherwise, use django's built in emailer.
-            #
-            current_site = Site.objects.get_current()
-            subject = render_to_string('approvals/approval_request_subj.txt',
-                                       { 'site'     : current_site,
-                                         'approval' : self })
-
-            # Email subject *must not* contain newlines
-            subject = ''.join(subject.splitlines())
-
-            # XXX django-mailer defines a limit of 100 characters
-            #     for a subject. We could change that, but better to be
-            #     safe and truncate subjects that are over 100 characters
-            #     here.
-            if len(subject) > 100:
-                subject = subject[0:99]
-
-            message = render_to_string('approvals/approval_request_email.txt',
-                                       { 'site'     : current_site,
-                                         'approval' : self })
-            if notification:
-                notification.send(User.objects.filter(is_staff = True),
-                                  "pending_approvals",
-                                  { 'message' : message,
-                                    'subject' : subject,
-                                    'site'    : current_site,
-                                    'approval': self })
-            else:
-                send_mail(subject, message, settings.DEFAULT_FROM_EMAIL,
-                          User.objects.filter(is_staff = True))
+        OutboxEntry.objects.create(kind = OutboxEntry.NEW_APPROVAL,
+                                   approval = self)
+        if self.approved is None:
+            PendingCount.objects.adjust(self.content_type_id, 1)
         return
 
     ####################################################################
     #
+    @metrics.timed('approvals.approve')
     def approve(self, approval_status, approver, reason = None):
         """
         This method does the work to mark an Approval as 'approved' or
@@ -177,16 +832,27 @@ class Approval(models.Model):
         'approved' field gets set), who acted on this Approval, and when it
         was approved.
 
-        NOTE: This will cause the Approval instance to be saved to the
-              database.
+        The approval can only be decided once. The decision is written
+        with a conditional UPDATE of just the decision columns that only
+        matches while the approval is still pending, so if two people
+        act on the same approval at the same time exactly one of them
+        wins and no row locks are held while they do it.
 
-        NOTE: This will cause the `approval_acted_on` signal to be
-              sent.  it is expected that other applications wanting to
+        NOTE: If this call won, the `approval_acted_on` signal is
+              sent. It is expected that other applications wanting to
               act on something be approved or not will listen for this
               signal and see if the object being acted upon is one
-              that they care about.
+              that they care about. If the approval was already
+              processed nothing is written and no signal is sent.
 
-        XXX We should probably only let an approval be set once.
+        NOTE: If the `APPROVALS_DEFER_ACTIONS` setting is True the
+              signal is not sent from here. Instead an `OutboxEntry` is
+              written in the same transaction as the decision and the
+              'process_approval_outbox' command sends the signal once
+              that transaction has been committed.
+
+        Returns True if this call decided the approval, False if it had
+        already been acted on.
 
         Arguments:
         - `approval_status`: Boolean - is this approved or not.
@@ -194,25 +860,777 @@ class Approval(models.Model):
         - `reason`: A string to set as the reason for accepting or denying
                     this approval request.
         """
+        values = decision_values(approval_status, approver, reason)
+        if not self._record_decision(values):
+            return False
+
+        for name, value in values.iteritems():
+            setattr(self, name, value)
+        if approval_status is not None:
+            metrics.record_decisions([self])
 
-        self.approved = approval_status
-        self.acted_on_by = approver
-        self.when_acted_on = datetime.datetime.utcnow()
-        if reason:
-            self.reason = reason
+        if not defer_actions():
+            approval_acted_on.send(sender = self)
+        return True
 
-        self.save()
+    ####################################################################
+    #
+    @metrics.timed('approvals.vote')
+    @atomic
+    def vote(self, approval_status, approver, reason = None):
+        """
+        Record `approver`'s vote on this approval, deciding it if that
+        is what the `ApprovalPolicy` for its content type calls for: a
+        vote to deny denies it and a vote to approve approves it once
+        'quorum' approvers have voted to approve it. An approver voting
+        again changes their vote.
 
-        approval_acted_on.send(sender = self)
+        Votes are counted one at a time, each holding the lock on the
+        approval's row from an UPDATE of its 'modified' time, so two
+        approvers voting at the same time can not both miss the
+        quorum.
+
+        `approve()` decides an approval whatever its policy says; the
+        views and the JSON API vote instead.
+
+        Returns True if the vote was counted, False if the approval had
+        already been acted on. Use `processed()` to see whether the vote
+        decided it.
+
+        Arguments:
+        - `approval_status`: Boolean - approve this or not.
+        - `approver`: User - the user that is voting.
+        - `reason`: A string to give as the reason for the vote.
+        """
+        if approval_status is None:
+            raise ValueError("A vote has to approve or deny")
+
+        if not Approval.objects.filter(pk = self.pk, approved = None).update(
+                modified = datetime.datetime.now()):
+            return False
+        ApprovalVote.objects.record(self, approver, approval_status, reason)
+
+        if approval_status:
+            quorum = ApprovalPolicy.objects.quorum_for(self.content_type_id)
+            if quorum > 1 and ApprovalVote.objects.filter(
+                    approval_id = self.id, approved = True).count() < quorum:
+                return True
+        self.approve(approval_status, approver, reason)
+        return True
+
+    ####################################################################
+    #
+    @atomic
+    def _record_decision(self, values):
+        """
+        Write the decision in `values` if this approval is still
+        pending, keeping the pending counts in step in the same
+        transaction. Returns True if the decision was written.
+        """
+        won = Approval.objects.filter(pk = self.pk,
+                                      approved = None).update(**values)
+        if won:
+            if values['approved'] is not None:
+                PendingCount.objects.adjust(self.content_type_id, -1)
+            if defer_actions():
+                OutboxEntry.objects.create(kind = OutboxEntry.ACTED_ON,
+                                           approval = self)
+        return bool(won)
+
+####################################################################
+#
+class ArchivedApprovalManager(models.Manager):
+    """
+    Manager for the approvals archive.
+    """
+
+    ####################################################################
+    #
+    def get_query_set(self):
+        return TargetQuerySet(self.model, using = self._db)
+
+    ####################################################################
+    #
+    def with_targets(self, querysets = None):
+        """
+        See `TargetQuerySet.with_targets()`.
+        """
+        return self.get_query_set().with_targets(querysets)
+
+    # The most approvals we move with a single INSERT ... SELECT and
+    # DELETE, keeping each statement under SQLite's limit of 999
+    # parameters.
+    #
+    ARCHIVE_BATCH_SIZE = 500
+
+    ####################################################################
+    #
+    def busy_ids(self):
+        """
+        Return the set of ids of the approvals that the outbox still has
+        work to do for: those with a pending entry of their own and
+        those listed in the payload of a pending batch entry.
+        """
+        busy = set(OutboxEntry.objects.filter(
+                approval__isnull = False,
+                status = OutboxEntry.PENDING).values_list('approval',
+                                                          flat = True))
+        for payload in OutboxEntry.objects.filter(
+                kind = OutboxEntry.ACTED_ON_BATCH,
+                status = OutboxEntry.PENDING).values_list('payload',
+                                                          flat = True):
+            busy.update(simplejson.loads(payload))
+        return busy
+
+    ####################################################################
+    #
+    @atomic
+    def archive(self, ids):
+        """
+        Move the decided approvals with the given ids from the live
+        approvals table to the archive with an INSERT ... SELECT and a
+        DELETE in one transaction. Their votes are deleted in the same
+        transaction; the decision they led to is in the archive.
+
+        Some approvals among the ids are left where they are:
+
+        - pending approvals;
+        - approvals the outbox still has work to do for, since the
+          worker loads them from the live table;
+        - the approval with the highest id. Archived approvals keep
+          their ids, so the live table must never hand out an id
+          again. SQLite tables created by syncdb and, after a restart,
+          MySQL's InnoDB tables number new rows from the highest id in
+          the table, so that row has to stay.
+
+        Outbox entries for the archived approvals are kept but no
+        longer point at them.
+
+        Returns the number of approvals archived.
+
+        Arguments:
+        - `ids`: A list of approval ids.
+        """
+        if not ids:
+            return 0
+        ids = list(ids)
+        skip = self.busy_ids()
+        skip.update(Approval.objects.order_by('-id').values_list(
+                'id', flat = True)[:1])
+
+        qn = connection.ops.quote_name
+        live_table = qn(Approval._meta.db_table)
+        columns = ", ".join([qn(f.column) for f in Approval._meta.local_fields])
+        stamp = connection.ops.value_to_db_datetime(datetime.datetime.now())
+        cursor = connection.cursor()
+        archived = 0
+        for start in range(0, len(ids), self.ARCHIVE_BATCH_SIZE):
+            chunk = [id for id in Approval.objects.filter(
+                    id__in = ids[start:start + self.ARCHIVE_BATCH_SIZE],
+                    approved__isnull = False).values_list('id', flat = True)
+                     if id not in skip]
+            if not chunk:
+                continue
+            where = "%s IN (%s) AND %s IS NOT NULL" % (
+                qn(Approval._meta.pk.column), ", ".join(["%s"] * len(chunk)),
+                qn(Approval._meta.get_field('approved').column))
+
+            OutboxEntry.objects.filter(approval__in = chunk).update(
+                approval = None)
+            ApprovalVote.objects.filter(approval_id__in = chunk).delete()
+            cursor.execute("INSERT INTO %s (%s, %s) SELECT %s, %%s FROM %s "
+                           "WHERE %s" % (qn(self.model._meta.db_table),
+                                         columns, qn('archived'), columns,
+                                         live_table, where),
+                           [stamp] + chunk)
+            cursor.execute("DELETE FROM %s WHERE %s" % (live_table, where),
+                           chunk)
+            archived += cursor.rowcount
+        transaction.set_dirty()
+        return archived
+
+####################################################################
+#
+class ArchivedApproval(ApprovalBase):
+    """
+    An approval that was decided a while ago and has been moved out of
+    the live approvals table by the 'archive_approvals' management
+    command. Decided approvals never change so there is no need to keep
+    them where they slow down working with the pending ones.
+
+    The approval keeps its id so links to it still work.
+    """
+    id = models.PositiveIntegerField(_('id'), primary_key = True)
+    archived = models.DateTimeField(_('archived'))
+    needs_approval = TargetForeignKey('content_type', 'object_id',
+                                      'object_key')
+
+    objects = ArchivedApprovalManager()
+
+    class Meta:
+        verbose_name = _('archived approval')
+        verbose_name_plural = _('archived approvals')
+        ordering = ['created']
+
+####################################################################
+#
+class ApprovalPolicyManager(models.Manager):
+    """
+    Manager for ApprovalPolicy objects.
+    """
+
+    ####################################################################
+    #
+    def quorum_for(self, content_type_id):
+        """
+        The number of approving votes an approval of the given content
+        type needs, which is 1 if it has no policy.
+        """
+        quorum = self.filter(content_type = content_type_id).values_list(
+            'quorum', flat = True)[:1]
+        return quorum and quorum[0] or 1
+
+    ####################################################################
+    #
+    def expiring(self):
+        """
+        The policies that decide approvals left pending too long.
+        """
+        return self.filter(expire_after_days__isnull = False)
+
+####################################################################
+#
+class ApprovalPolicy(models.Model):
+    """
+    Who approves approvals of objects of one content type, and how many
+    of them have to. The approvers are the users and groups assigned to
+    the policy with `ApprovalAssignment`s.
+
+    A policy can also say that approvals left pending for
+    'expire_after_days' are decided automatically, denied or approved
+    as 'expire_action' says, by the 'expire_approvals' management
+    command.
+    """
+    DENY = 'deny'
+    APPROVE = 'approve'
+    EXPIRE_ACTION_CHOICES = (
+        (DENY, _('deny')),
+        (APPROVE, _('approve')),
+        )
+
+    content_type = models.ForeignKey(ContentType, unique = True,
+                                     verbose_name = _("content type"))
+    quorum = models.PositiveIntegerField(_('quorum'), default = 1,
+                                         help_text = _("The number of "
+                                                       "approvers that have "
+                                                       "to approve an "
+                                                       "approval. Any one "
+                                                       "of them can deny "
+                                                       "it."))
+    expire_after_days = models.PositiveIntegerField(
+        _('expire after days'), null = True, blank = True,
+        help_text = _("Decide approvals that are still pending after this "
+                      "many days. Leave empty to let them wait."))
+    expire_action = models.CharField(_('expire action'), max_length = 16,
+                                     choices = EXPIRE_ACTION_CHOICES,
+                                     default = DENY,
+                                     help_text = _("How expired approvals "
+                                                   "are decided."))
+
+    objects = ApprovalPolicyManager()
+
+    class Meta:
+        verbose_name = _('approval policy')
+        verbose_name_plural = _('approval policies')
+
+    ####################################################################
+    #
+    def __unicode__(self):
+        return u"%s, quorum %d" % (self.content_type, self.quorum)
+
+    ####################################################################
+    #
+    def expired(self, now = None):
+        """
+        The approvals of this policy's content type that have been
+        pending for longer than 'expire_after_days' at `now`, by
+        default now. None of them if the policy does not expire them.
+        """
+        if self.expire_after_days is None:
+            return Approval.objects.none()
+        if now is None:
+            now = datetime.datetime.now()
+        return Approval.objects.filter(
+            approved = None, content_type = self.content_type_id,
+            created__lt = now - datetime.timedelta(
+                days = self.expire_after_days))
+
+    ####################################################################
+    #
+    def expire(self, now = None, chunk_size = 1000, sleep = 0):
+        """
+        Decide this policy's approvals that have been pending for longer
+        than 'expire_after_days', as 'expire_action' says, with no
+        approver and a reason saying they expired. Returns the number
+        of approvals decided.
+
+        The expired approvals are walked oldest first along the
+        (approved, content_type_id, created, id) index a chunk at a
+        time, and each chunk is decided with
+        `ApprovalQuerySet.decide()`: one UPDATE and one
+        `approvals_acted_on_batch` signal in its own short transaction.
+        However many there are, no lock is held for longer than one
+        chunk takes.
+
+        Arguments:
+        - `now`: The time to measure the age of the approvals from,
+                 by default now.
+        - `chunk_size`: The number of approvals to decide at a time.
+        - `sleep`: Seconds to wait between chunks.
+        """
+        if self.expire_after_days is None:
+            return 0
+        expired = self.expired(now)
+        approval_status = self.expire_action == ApprovalPolicy.APPROVE
+        reason = unicode(_("Expired after %d days")) % \
+            self.expire_after_days
+
+        total = 0
+        after = None
+        while True:
+            chunk = expired
+            if after is not None:
+                chunk = chunk.filter(Q(created__gt = after[0]) |
+                                     Q(created = after[0], id__gt = after[1]))
+            rows = list(chunk.order_by('created', 'id').values_list(
+                    'created', 'id')[:chunk_size])
+            if not rows:
+                break
+            after = rows[-1]
+            total += len(Approval.objects.filter(
+                    id__in = [id for created, id in rows]).decide(
+                    approval_status, None, reason))
+            if sleep:
+                time.sleep(sleep)
+        return total
+
+####################################################################
+#
+class ApprovalAssignment(models.Model):
+    """
+    A user, or every member of a group, assigned to approve the
+    approvals covered by a policy. Each assignment has either a user or
+    a group.
+    """
+    policy = models.ForeignKey(ApprovalPolicy, related_name = 'assignments',
+                               verbose_name = _("policy"))
+    user = models.ForeignKey(User, null = True, blank = True,
+                             verbose_name = _("user"))
+    group = models.ForeignKey(Group, null = True, blank = True,
+                              verbose_name = _("group"))
+
+    class Meta:
+        verbose_name = _('approval assignment')
+        verbose_name_plural = _('approval assignments')
+
+    ####################################################################
+    #
+    def __unicode__(self):
+        return u"%s: %s" % (self.policy.content_type, self.user or self.group)
+
+# Who the approvers are changes along with the assignments.
+#
+post_save.connect(recipients.invalidate, sender = ApprovalAssignment)
+post_delete.connect(recipients.invalidate, sender = ApprovalAssignment)
+
+####################################################################
+#
+class ApprovalVoteManager(models.Manager):
+    """
+    Manager for ApprovalVote objects.
+    """
+
+    ####################################################################
+    #
+    def record(self, approval, user, approved, reason = None):
+        """
+        Record `user`'s vote on `approval`, replacing any vote they made
+        on it before.
+        """
+        sid = transaction.savepoint()
+        try:
+            self.create(approval_id = approval.id, user = user,
+                        approved = approved, reason = reason or '')
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            self.filter(approval_id = approval.id, user = user).update(
+                approved = approved, reason = reason or '',
+                created = datetime.datetime.now())
         return
 
-    ##################################################################
+####################################################################
+#
+class ApprovalVote(models.Model):
+    """
+    One approver's vote on an approval, counted towards the quorum of
+    the approval's policy.
+
+    The approval is referred to by its id rather than a foreign key.
+    Votes only count while an approval is pending, so
+    `ArchivedApprovalManager.archive()` deletes them along with the
+    approval.
+    """
+    approval_id = models.PositiveIntegerField(_('approval id'))
+    user = models.ForeignKey(User, verbose_name = _("user"))
+    approved = models.BooleanField(_('approved'))
+    reason = models.TextField(_('reason'), max_length = 2048, blank = True)
+    created = models.DateTimeField(_('created'), auto_now_add = True)
+
+    objects = ApprovalVoteManager()
+
+    class Meta:
+        verbose_name = _('approval vote')
+        verbose_name_plural = _('approval votes')
+        unique_together = (('approval_id', 'user'),)
+        ordering = ['created']
+
+    ####################################################################
     #
-    def processed(self):
+    def __unicode__(self):
+        return u"%s %s approval %d" % (self.user, self.approved and
+                                       "approved" or "denied",
+                                       self.approval_id)
+
+####################################################################
+#
+def approval_deleted(sender, instance, **kwargs):
+    """
+    Signal handler for `post_delete` of Approval objects that keeps the
+    pending counts right when a pending approval is deleted.
+    """
+    if instance.approved is None:
+        PendingCount.objects.adjust(instance.content_type_id, -1)
+    return
+
+post_delete.connect(approval_deleted, sender = Approval)
+
+####################################################################
+#
+class PendingCountManager(models.Manager):
+    """
+    Manager for the pending approval counters.
+    """
+
+    CACHE_KEY = 'approvals.models.pending_counts'
+
+    ####################################################################
+    #
+    def adjust(self, content_type_id, delta):
         """
-        A helper method that tells you whether or not this approval
-        has already been acted on. Most UI's are going to want an
-        approval to only be acted on once.
+        Atomically add `delta` to the number of pending approvals for
+        the given content type, creating its counter if need be.
+
+        Arguments:
+        - `content_type_id`: The id of the ContentType to adjust.
+        - `delta`: The number to add, negative to subtract.
         """
-        return self.approved is not None
+        if not self.filter(content_type = content_type_id).update(
+                count = F('count') + delta):
+            # The first approval of this type. If someone else creates
+            # the counter at the same time the unique constraint on
+            # content_type stops us and we update theirs instead.
+            #
+            sid = transaction.savepoint()
+            try:
+                self.create(content_type_id = content_type_id,
+                            count = delta)
+                transaction.savepoint_commit(sid)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid)
+                self.filter(content_type = content_type_id).update(
+                    count = F('count') + delta)
+        cache.delete(self.CACHE_KEY)
+        return
 
+    ####################################################################
+    #
+    def counts(self):
+        """
+        Return a dictionary mapping ContentTypes to the number of
+        pending approvals of that type, leaving out the types with
+        none. This reads the small counters table, not the approvals
+        table, and the result is cached for
+        `APPROVALS_PENDING_COUNTS_CACHE_TIMEOUT` seconds (default 60)
+        or until a counter changes, so it is cheap enough to show on
+        every page.
+        """
+        counts = cache.get(self.CACHE_KEY)
+        if counts is None:
+            counts = dict(self.filter(count__gt = 0).values_list(
+                    'content_type', 'count'))
+            cache.set(self.CACHE_KEY, counts,
+                      getattr(settings,
+                              'APPROVALS_PENDING_COUNTS_CACHE_TIMEOUT', 60))
+        return dict([(ContentType.objects.get_for_id(ct_id), n)
+                     for ct_id, n in counts.iteritems()])
+
+    ####################################################################
+    #
+    @atomic
+    def reconcile(self):
+        """
+        Recount the pending approvals for every content type from the
+        approvals table and fix any counters that have drifted, for
+        instance because approvals were changed with `update()` or raw
+        SQL.
+
+        Returns a dictionary mapping the ids of the content types whose
+        counters were wrong to a tuple of the old and new counts.
+        """
+        actual = dict(Approval.objects.filter(approved = None).values_list(
+                'content_type').annotate(n = Count('id')).order_by())
+        fixed = {}
+        for counter in self.all():
+            n = actual.pop(counter.content_type_id, 0)
+            if counter.count != n:
+                fixed[counter.content_type_id] = (counter.count, n)
+                self.filter(pk = counter.pk).update(count = n)
+        for ct_id, n in actual.iteritems():
+            fixed[ct_id] = (0, n)
+            self.create(content_type_id = ct_id, count = n)
+        cache.delete(self.CACHE_KEY)
+        return fixed
+
+####################################################################
+#
+class PendingCount(models.Model):
+    """
+    The number of pending approvals for one content type.
+
+    These are kept up to date as approvals are created and decided so
+    that showing how many approvals are waiting does not need a
+    COUNT(*) over the approvals table. The 'reconcile_pending_counts'
+    management command repairs them if they drift.
+    """
+    content_type = models.ForeignKey(ContentType, unique = True,
+                                     verbose_name = _("content type"))
+    count = models.IntegerField(_('count'), default = 0)
+
+    objects = PendingCountManager()
+
+    class Meta:
+        verbose_name = _('pending count')
+        verbose_name_plural = _('pending counts')
+
+    ####################################################################
+    #
+    def __unicode__(self):
+        return u"%s: %d" % (self.content_type, self.count)
+
+####################################################################
+#
+class OutboxEntryManager(models.Manager):
+    """
+    Manager for the outbox. Provides the methods the background
+    worker uses to find and deliver the entries that are due.
+    """
+
+    ####################################################################
+    #
+    def due(self, now = None):
+        """
+        Return a queryset of the pending entries that are ready to be
+        delivered, oldest first.
+
+        Arguments:
+        - `now`: datetime to compare `next_attempt` against. Defaults
+                 to the current time.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        return self.filter(status = OutboxEntry.PENDING,
+                           next_attempt__lte = now).order_by('next_attempt',
+                                                             'id')
+
+    ####################################################################
+    #
+    def deliver_due(self, batch_size = 100):
+        """
+        Deliver at most `batch_size` of the entries that are due.
+
+        Returns a tuple of the number of entries that were delivered and
+        the number that failed.
+
+        Arguments:
+        - `batch_size`: The maximum number of entries to work on.
+        """
+        delivered = failed = 0
+        for entry in self.due()[:batch_size]:
+            if not entry.claim():
+                # Some other worker got to this entry first.
+                #
+                continue
+            if entry.deliver():
+                delivered += 1
+            else:
+                failed += 1
+        return (delivered, failed)
+
+####################################################################
+#
+class OutboxEntry(models.Model):
+    """
+    A message that needs to be sent, or a signal that needs to be
+    sent when `APPROVALS_DEFER_ACTIONS` is True, because of something
+    that happened to an Approval.
+
+    Entries are written in the same transaction as the change to the
+    Approval that caused them and delivered later by the
+    'process_approval_outbox' management command. Delivery is retried
+    with an increasing delay until `APPROVALS_OUTBOX_MAX_ATTEMPTS` is
+    reached, after which the entry is marked as failed and the error
+    is kept in `last_error`.
+    """
+    NEW_APPROVAL = 'new_approval'
+    DIGEST = 'digest'
+    ACTED_ON = 'acted_on'
+    ACTED_ON_BATCH = 'acted_on_batch'
+    KIND_CHOICES = (
+        (NEW_APPROVAL, _('new approval')),
+        (DIGEST, _('digest of new approvals')),
+        (ACTED_ON, _('approval acted on')),
+        (ACTED_ON_BATCH, _('approvals acted on')),
+        )
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('pending')),
+        (SENT, _('sent')),
+        (FAILED, _('failed')),
+        )
+
+    kind = models.CharField(_('kind'), max_length = 32,
+                            choices = KIND_CHOICES)
+    approval = models.ForeignKey(Approval, null = True, blank = True,
+                                 verbose_name = _('approval'))
+    status = models.CharField(_('status'), max_length = 16,
+                              choices = STATUS_CHOICES, default = PENDING,
+                              db_index = True)
+    created = models.DateTimeField(_('created'), auto_now_add = True)
+    next_attempt = models.DateTimeField(_('next attempt'), db_index = True,
+                                        default = datetime.datetime.now)
+    attempts = models.PositiveIntegerField(_('attempts'), default = 0)
+    sent = models.DateTimeField(_('sent'), null = True, blank = True)
+    last_error = models.TextField(_('last error'), blank = True)
+
+    # Extra data some kinds of entries need, JSON encoded. For a digest
+    # this maps content type ids to the number of new approvals, for a
+    # batch of decided approvals it is the list of their ids.
+    #
+    payload = models.TextField(_('payload'), blank = True)
+
+    objects = OutboxEntryManager()
+
+    class Meta:
+        verbose_name = _('outbox entry')
+        verbose_name_plural = _('outbox entries')
+        ordering = ['created']
+
+    ####################################################################
+    #
+    def __unicode__(self):
+        return u"%s, %s, %s" % (self.kind, self.status, self.approval_id)
+
+    ####################################################################
+    #
+    def claim(self):
+        """
+        Mark this entry as being worked on by bumping its attempt
+        count and pushing its `next_attempt` out by the retry delay.
+
+        This is a conditional update on the attempt count we read so
+        when several workers are draining the outbox only one of them
+        gets to deliver any given entry. If the worker dies the entry
+        simply becomes due again once the retry delay has passed.
+
+        Returns True if we got the entry, False if someone else did.
+        """
+        now = datetime.datetime.now()
+        next_attempt = now + self.retry_delay(self.attempts + 1)
+        claimed = OutboxEntry.objects.filter(
+            pk = self.pk, status = OutboxEntry.PENDING,
+            attempts = self.attempts).update(attempts = F('attempts') + 1,
+                                             next_attempt = next_attempt)
+        if claimed:
+            self.attempts += 1
+            self.next_attempt = next_attempt
+        return bool(claimed)
+
+    ####################################################################
+    #
+    def retry_delay(self, attempts):
+        """
+        How long to wait before trying this entry again after it has
+        been tried `attempts` times. The delay doubles with every
+        attempt starting from `APPROVALS_OUTBOX_RETRY_DELAY` seconds.
+        """
+        delay = getattr(settings, 'APPROVALS_OUTBOX_RETRY_DELAY', 60)
+        return datetime.timedelta(seconds = delay * (2 ** (attempts - 1)))
+
+    ####################################################################
+    #
+    def deliver(self):
+        """
+        Send the message this entry represents and record the outcome.
+        The caller is expected to have `claim()`ed the entry first.
+
+        Returns True if the message went out.
+        """
+        try:
+            self._deliver()
+        except Exception, e:
+            max_attempts = getattr(settings, 'APPROVALS_OUTBOX_MAX_ATTEMPTS',
+                                   5)
+            self.last_error = u"%s: %s" % (e.__class__.__name__, e)
+            if self.attempts >= max_attempts:
+                self.status = OutboxEntry.FAILED
+            OutboxEntry.objects.filter(pk = self.pk).update(
+                status = self.status, last_error = self.last_error)
+            return False
+
+        self.status = OutboxEntry.SENT
+        self.sent = datetime.datetime.now()
+        OutboxEntry.objects.filter(pk = self.pk).update(status = self.status,
+                                                        sent = self.sent)
+        return True
+
+    ####################################################################
+    #
+    @atomic
+    def _deliver(self):
+        """
+        Do the work of delivering this entry. This runs in its own
+        transaction so that if a receiver of a deferred signal fails
+        whatever it had written is rolled back before it is retried.
+        """
+        if self.kind == OutboxEntry.NEW_APPROVAL:
+            notify.notify_new_approval(self.approval)
+        elif self.kind == OutboxEntry.DIGEST:
+            counts = simplejson.loads(self.payload)
+            notify.notify_digest(dict([(int(k), v) for k, v in
+                                       counts.iteritems()]))
+        elif self.kind == OutboxEntry.ACTED_ON:
+            approval_acted_on.send(sender = self.approval)
+        elif self.kind == OutboxEntry.ACTED_ON_BATCH:
+            approvals = list(Approval.objects.filter(
+                    id__in = simplejson.loads(self.payload)).select_related(
+                    'acted_on_by'))
+            if approvals:
+                approvals_acted_on_batch.send(sender = Approval,
+                                              approvals = approvals)
+        else:
+            raise ValueError("Unknown outbox entry kind: %s" % self.kind)
+        return
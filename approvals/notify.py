@@ -0,0 +1,261 @@
+#
+# File: $Id$
+#
+"""
+The code that actually tells the approvers about new approvals.
+
+Nothing in here is called while an Approval is being saved. Instead
+`Approval.save()` queues an `OutboxEntry` and the
+'process_approval_outbox' management command calls in to this module
+to deliver it. That keeps the rendering of templates and the talking
+to a mail server off of the request that created the approval.
+
+The messages are rendered here and handed to the notifier named by the
+`APPROVALS_NOTIFIER` setting (see `approvals.backends`) to deliver:
+
+- 'approvals.notify.NotificationNotifier' sends them with
+  django-notification, which also creates notification objects.
+- 'approvals.notify.MailerNotifier' queues them with django-mailer.
+- 'approvals.notify.EmailNotifier' emails them with `approvals.mail`.
+
+If the setting is not set the first of those whose app is in
+INSTALLED_APPS is used, the last one if neither is. Any other class
+with a `notify()` method like theirs works too.
+"""
+
+# Django imports
+#
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.template.loader import render_to_string
+from django.utils.importlib import import_module
+
+# Model imports
+#
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+
+# Approvals imports
+#
+from approvals import backends, mail
+from approvals.metrics import timer
+from approvals.recipients import approver_ids, emails_for
+
+####################################################################
+#
+class EmailNotifier(object):
+    """
+    The notifier that emails the approvers with `approvals.mail`, in
+    batches over one connection. It also documents the method a
+    notifier has.
+    """
+
+    ####################################################################
+    #
+    def notify(self, notices):
+        """
+        Deliver `notices`, a list of (user ids, context) pairs: the ids
+        of the approvers to tell and the context the message was
+        rendered with, which has the rendered 'subject' and 'message'
+        as well as the 'site' and whatever else the templates got.
+        """
+        mail.send_all([(context['subject'], context['message'],
+                        emails_for(sorted(ids)))
+                       for ids, context in notices])
+
+####################################################################
+#
+class MailerNotifier(object):
+    """
+    The notifier that queues the emails with django-mailer's
+    'send_mail', which then does the delivering.
+    """
+
+    ####################################################################
+    #
+    def __init__(self):
+        self.send_mail = import_module('mailer').send_mail
+
+    ####################################################################
+    #
+    def notify(self, notices):
+        for ids, context in notices:
+            addresses = emails_for(sorted(ids))
+            if addresses:
+                self.send_mail(context['subject'], context['message'],
+                               settings.DEFAULT_FROM_EMAIL, addresses)
+
+####################################################################
+#
+class NotificationNotifier(object):
+    """
+    The notifier that sends a 'pending_approvals' notice with
+    django-notification, which also creates notification objects.
+    """
+
+    ####################################################################
+    #
+    def __init__(self):
+        self.notification = import_module('notification.models')
+
+    ####################################################################
+    #
+    def notify(self, notices):
+        for ids, context in notices:
+            self.notification.send(User.objects.filter(id__in = ids),
+                                   "pending_approvals", context)
+
+####################################################################
+#
+def default_notifier():
+    """
+    The notifier used when `APPROVALS_NOTIFIER` is not set: the first
+    of django-notification and django-mailer that is installed, or
+    plain email.
+    """
+    if 'notification' in settings.INSTALLED_APPS:
+        return 'approvals.notify.NotificationNotifier'
+    if 'mailer' in settings.INSTALLED_APPS:
+        return 'approvals.notify.MailerNotifier'
+    return 'approvals.notify.EmailNotifier'
+
+####################################################################
+#
+def get_notifier():
+    """
+    The notifier named by the `APPROVALS_NOTIFIER` setting.
+    """
+    return backends.get_backend('APPROVALS_NOTIFIER', default_notifier)
+
+####################################################################
+#
+def render_subject(template_name, context):
+    """
+    Render the template for the subject of an email/notification.
+
+    Arguments:
+    - `template_name`: The template to render.
+    - `context`: Dictionary of context for the template.
+    """
+    subject = render_to_string(template_name, context)
+
+    # Email subject *must not* contain newlines
+    subject = ''.join(subject.splitlines())
+
+    # XXX django-mailer defines a limit of 100 characters
+    #     for a subject. We could change that, but better to be
+    #     safe and truncate subjects that are over 100 characters
+    #     here.
+    if len(subject) > 100:
+        subject = subject[0:99]
+    return subject
+
+####################################################################
+#
+def notify_new_approval(approval):
+    """
+    Send a message to the approvers of the approval's content type that
+    there is a new item requiring their attention, with the notifier
+    from `get_notifier()`.
+
+    Arguments:
+    - `approval`: The newly created approvals.models.Approval
+    """
+    with timer('approvals.notify.new_approval.render'):
+        current_site = Site.objects.get_current()
+        context = { 'site'     : current_site,
+                    'approval' : approval }
+        subject = render_subject('approvals/approval_request_subj.txt',
+                                 context)
+        message = render_to_string('approvals/approval_request_email.txt',
+                                   context)
+    context.update({ 'message' : message,
+                     'subject' : subject })
+    notifier = get_notifier()
+    with timer('approvals.notify.new_approval.send'):
+        notifier.notify([(approver_ids(approval.content_type_id), context)])
+    return
+
+####################################################################
+#
+def notify_digest(counts):
+    """
+    Send a single message to the approvers about a whole batch of new
+    approvals, as created by `Approval.objects.request_many()`. Each
+    approver only hears about the content types they approve, so the
+    approvers are grouped by those and each group gets its own digest.
+    The digests are all handed to the notifier at once, so that it can
+    email them over one connection.
+
+    The templates get the list of (content type, count) pairs as
+    'approval_counts' and their sum as 'total'.
+
+    Arguments:
+    - `counts`: Dictionary mapping content type ids to the number of
+                new approvals of that type.
+    """
+    by_user = {}
+    for ct_id in counts:
+        for id in approver_ids(ct_id):
+            by_user.setdefault(id, set()).add(ct_id)
+    groups = {}
+    for id, ct_ids in by_user.iteritems():
+        groups.setdefault(frozenset(ct_ids), []).append(id)
+
+    current_site = Site.objects.get_current()
+    notices = []
+    for ct_ids, ids in groups.iteritems():
+        with timer('approvals.notify.digest.render'):
+            approval_counts = [(ContentType.objects.get_for_id(ct_id),
+                                counts[ct_id]) for ct_id in sorted(ct_ids)]
+            context = { 'site'            : current_site,
+                        'approval_counts' : approval_counts,
+                        'total'           : sum([n for ct, n in
+                                                 approval_counts]) }
+            subject = render_subject('approvals/approval_digest_subj.txt',
+                                     context)
+            message = render_to_string('approvals/approval_digest_email.txt',
+                                       context)
+        context.update({ 'message' : message,
+                         'subject' : subject })
+        notices.append((ids, context))
+    if notices:
+        notifier = get_notifier()
+        with timer('approvals.notify.digest.send'):
+            notifier.notify(notices)
+    return
+
+####################################################################
+#
+def reminder_message(approver, approval_counts, approvals, site = None):
+    """
+    Build the email reminding one approver of the approvals that are
+    still waiting on them. The caller sends it, which lets
+    the 'send_approval_reminders' command send all of the reminders
+    over one connection with `approvals.mail.deliver()`.
+
+    The templates get 'approver', 'approval_counts', a list of
+    (content type, count) pairs, 'total', the sum of those counts,
+    'approvals', the oldest few of the pending approvals, and 'site'.
+
+    Arguments:
+    - `approver`: The User to remind.
+    - `approval_counts`: List of (ContentType, count) pairs.
+    - `approvals`: List of some of the pending Approvals to list.
+    - `site`: The current Site, looked up if not given.
+    """
+    if site is None:
+        site = Site.objects.get_current()
+    context = { 'site'            : site,
+                'approver'        : approver,
+                'approval_counts' : approval_counts,
+                'approvals'       : approvals,
+                'total'           : sum([n for ct, n in approval_counts]) }
+    with timer('approvals.notify.reminder.render'):
+        subject = render_subject('approvals/approval_reminder_subj.txt',
+                                 context)
+        message = render_to_string('approvals/approval_reminder_email.txt',
+                                   context)
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL,
+                        [approver.email])
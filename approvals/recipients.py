@@ -0,0 +1,210 @@
+#
+# File: $Id$
+#
+"""
+Who gets told about approvals, and who may act on them.
+
+The approvers of approvals for a content type are the users assigned
+to its `ApprovalPolicy`, directly or through their groups. Approvals
+of content types with no assigned approvers fall back to the is_staff
+users, as approvals always did before there were policies.
+
+Working out the approvers means several queries, so instead of doing
+that for every new approval we keep them in Django's cache framework.
+The cached approvers are thrown away by the signal handlers in this
+module, which `approvals.models` connects, whenever a user, a group
+membership or an assignment changes in a way that could change them.
+"""
+
+# Django imports
+#
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+# Model imports
+#
+from django.contrib.auth.models import User
+
+CACHE_KEY = 'approvals.recipients.approvers'
+
+####################################################################
+#
+def get_approvers():
+    """
+    Return the cached approvers, a dictionary with:
+
+    - 'staff': The ids of the is_staff users.
+    - 'by_ct': A dictionary mapping the id of each content type that
+               has assigned approvers to the list of their ids.
+    - 'emails': A dictionary mapping the ids of all of those users to
+                their email addresses, for those that have one.
+
+    The result is cached for `APPROVALS_APPROVERS_CACHE_TIMEOUT` seconds
+    (default one day) or until something invalidates it.
+    """
+    approvers = cache.get(CACHE_KEY)
+    if approvers is not None:
+        return approvers
+
+    # Imported here because approvals.models imports us.
+    #
+    from approvals.models import ApprovalAssignment
+
+    staff = []
+    emails = {}
+    for id, email in User.objects.filter(is_staff = True).values_list(
+            'id', 'email').order_by('id'):
+        staff.append(id)
+        if email:
+            emails[id] = email
+
+    by_ct = {}
+    group_cts = {}
+    for ct_id, user_id, group_id in ApprovalAssignment.objects.values_list(
+            'policy__content_type', 'user', 'group'):
+        if user_id is not None:
+            by_ct.setdefault(ct_id, set()).add(user_id)
+        if group_id is not None:
+            group_cts.setdefault(group_id, set()).add(ct_id)
+    if group_cts:
+        for user_id, group_id in User.groups.through.objects.filter(
+                group__in = group_cts.keys()).values_list('user', 'group'):
+            for ct_id in group_cts[group_id]:
+                by_ct.setdefault(ct_id, set()).add(user_id)
+
+    assigned = set()
+    for ids in by_ct.values():
+        assigned.update(ids)
+    assigned.difference_update(emails.keys())
+    if assigned:
+        for id, email in User.objects.filter(id__in = assigned).values_list(
+                'id', 'email'):
+            if email:
+                emails[id] = email
+
+    approvers = { 'staff'  : staff,
+                  'by_ct'  : dict([(ct_id, sorted(ids)) for ct_id, ids in
+                                   by_ct.iteritems()]),
+                  'emails' : emails }
+    cache.set(CACHE_KEY, approvers,
+              getattr(settings, 'APPROVALS_APPROVERS_CACHE_TIMEOUT',
+                      60 * 60 * 24))
+    return approvers
+
+####################################################################
+#
+def approver_ids(content_type_id = None):
+    """
+    The ids of the users that approve approvals of the given content
+    type, or the is_staff users if no content type is given.
+    """
+    approvers = get_approvers()
+    return approvers['by_ct'].get(content_type_id, approvers['staff'])
+
+####################################################################
+#
+def approver_emails(content_type_id = None):
+    """
+    The email addresses of the users that approve approvals of the
+    given content type.
+    """
+    return emails_for(approver_ids(content_type_id))
+
+####################################################################
+#
+def emails_for(ids):
+    """
+    The email addresses of the approvers with the given ids, leaving out
+    the ones without an address.
+    """
+    emails = get_approvers()['emails']
+    return [emails[id] for id in ids if id in emails]
+
+####################################################################
+#
+def approver_users(content_type_id = None):
+    """
+    A queryset of the users that approve approvals of the given content
+    type, for APIs such as django-notification's that want User
+    objects. It is a primary key lookup instead of a scan for is_staff
+    or a join through the assignments.
+    """
+    return User.objects.filter(id__in = approver_ids(content_type_id))
+
+####################################################################
+#
+def approver_content_types(user):
+    """
+    Return a tuple of the list of ids of the content types that `user`
+    is assigned to approve and whether they approve the content types
+    that have no assigned approvers, ie: whether they are staff.
+    """
+    approvers = get_approvers()
+    assigned = [ct_id for ct_id, ids in approvers['by_ct'].iteritems()
+                if user.id in ids]
+    return (assigned, user.id in approvers['staff'])
+
+####################################################################
+#
+def is_approver(user, content_type_id = None):
+    """
+    True if `user` may act on approvals of the given content type, or
+    on any approvals at all if no content type is given.
+    """
+    if not user.is_authenticated():
+        return False
+    if content_type_id is None:
+        assigned, staff = approver_content_types(user)
+        return staff or bool(assigned)
+    return user.id in approver_ids(content_type_id)
+
+####################################################################
+#
+def approvable_by(user):
+    """
+    A Q object matching the approvals that `user` may act on, for
+    filtering a queryset of approvals.
+    """
+    assigned, staff = approver_content_types(user)
+    if not staff:
+        return Q(content_type__in = assigned)
+
+    # Staff also approve everything nobody has been assigned to.
+    #
+    with_approvers = get_approvers()['by_ct'].keys()
+    if not with_approvers:
+        return Q()
+    return Q(content_type__in = assigned) | \
+        ~Q(content_type__in = with_approvers)
+
+####################################################################
+#
+def invalidate(**kwargs):
+    """
+    Throw away the cached approvers. The signature lets this be
+    connected directly to any signal.
+    """
+    cache.delete(CACHE_KEY)
+    return
+
+####################################################################
+#
+def user_changed(sender, instance, **kwargs):
+    """
+    Signal handler for `post_save` and `post_delete` of User objects.
+
+    Users are saved all the time (every login updates `last_login`) so
+    we only throw away the cached approvers when the user is, or was
+    until now, one of them.
+    """
+    if instance.is_staff:
+        invalidate()
+        return
+    approvers = cache.get(CACHE_KEY)
+    if approvers is None:
+        return
+    if instance.id in approvers['staff'] or \
+            [ids for ids in approvers['by_ct'].values() if instance.id in ids]:
+        invalidate()
+    return
@@ -0,0 +1,298 @@
+#
+# File: $Id$
+#
+"""
+Requiring approval for user registrations with James Bennett's
+django-registration, the case the approvals app was first written for.
+
+Only 'approvals.accounts_urls' and, when this module is named in
+`APPROVALS_HANDLER_MODULES`, the handler registry import it, so
+django-registration is only loaded by projects that use it. It has:
+
+- `create_registration()`, which creates an inactive user, their
+  RegistrationProfile and its Approval in one transaction.
+- `RegistrationFormNeedsApproval` and
+  `RegistrationFormUniqueEmailNeedsApproval`, registration forms that
+  create an approval instead of sending the activation email.
+- `register_user()` and `register_users()`, handlers for
+  `approvals.registry.approval_handlers` that send the activation
+  emails once the registrations are approved. They are registered
+  when this module is imported, along with the queryset that lists
+  of approvals fetch the profiles from, with their users joined in
+  for `RegistrationProfile.__unicode__()`. The registry imports it
+  when it is named in `APPROVALS_HANDLER_MODULES`, as it is by
+  default when 'registration' is in INSTALLED_APPS.
+"""
+
+# Django imports
+#
+from django import forms
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.template.loader import render_to_string
+from django.utils.translation import ugettext_lazy as _
+
+# Model imports
+#
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from registration.forms import RegistrationForm
+from registration.models import RegistrationProfile
+from approvals.models import Approval, prefetch_targets
+
+# Approvals imports
+#
+from approvals import mail
+from approvals.registry import approval_handlers
+from approvals.utils import atomic
+
+####################################################################
+#
+def normalize_email(email):
+    """
+    Lowercase the domain part of an email address, as
+    `User.objects.create_user()` does.
+    """
+    try:
+        email_name, domain_part = email.strip().split('@', 1)
+    except ValueError:
+        return email
+    return '@'.join([email_name, domain_part.lower()])
+
+####################################################################
+#
+@atomic
+def create_registration(username, password, email,
+                        profile_callback = None):
+    """
+    Create an inactive User, their RegistrationProfile and the
+    Approval of it, all in one transaction, so a failure part way
+    through does not leave a user behind that nobody will ever be
+    asked to approve.
+
+    This does what ``create_inactive_user()`` does, without sending
+    the activation email, but inserts the user already inactive
+    instead of inserting and then updating them and keeps the
+    profile it creates instead of fetching it again.
+
+    Arguments:
+    - `username`: The new user's username.
+    - `password`: Their password, in the clear.
+    - `email`: Their email address.
+    - `profile_callback`: Optional callable, given the new user as
+                          the `user` keyword argument, to create
+                          any other profile for them.
+    """
+    new_user = User(username = username, email = normalize_email(email),
+                    is_active = False)
+    new_user.set_password(password)
+    new_user.save()
+
+    reg_profile = RegistrationProfile.objects.create_profile(new_user)
+    if profile_callback is not None:
+        profile_callback(user = new_user)
+
+    # The profile was created just now, so there is no approval of
+    # it for `request_approval()` to look for.
+    #
+    Approval(needs_approval = reg_profile).save()
+    return new_user
+
+####################################################################
+#
+class RegistrationFormNeedsApproval(RegistrationForm):
+    """
+    Form for registering a new account, but mark it for needing
+    approval.  This is done by override the save() method so that
+    when it creates an inactive user it does NOT send email, and
+    creates an approval object.
+    """
+
+    ####################################################################
+    #
+    def save(self, profile_callback = None):
+        """
+        Create the new 'User', 'RegistrationProfile', and 'Approval'
+        object.
+
+        This is essentially a light wrapper around
+        `create_registration()`, feeding it the form data and a
+        profile callback (see the documentation on
+        ``create_inactive_user()`` for details) if supplied.
+
+        """
+        return create_registration(self.cleaned_data['username'],
+                                   self.cleaned_data['password1'],
+                                   self.cleaned_data['email'],
+                                   profile_callback)
+
+####################################################################
+#
+class RegistrationFormUniqueEmailNeedsApproval(RegistrationFormNeedsApproval):
+    """
+    Just like RegistrationFormUniqueEmail except they will require
+    an approval before they are sent their registration
+    email. This is done by overriding the save() method so that when
+    it creates an inactive user it does NOT send email, and
+    creates an approval object.
+    """
+
+    ####################################################################
+    #
+    def clean_email(self):
+        """
+        Validate that the supplied email address is unique for the
+        site.
+
+        On PostgreSQL the case insensitive lookup uses the index on
+        UPPER(email) that syncdb creates (see
+        `approvals.management`).
+        """
+        if not User.objects.filter(
+                email__iexact = self.cleaned_data['email']).exists():
+            return self.cleaned_data['email']
+        raise forms.ValidationError(_(u'This email address is already in '
+                                      u'use. Please supply a different '
+                                      u'email address.'))
+
+####################################################################
+#
+def register_user(sender, **kwargs):
+    """
+    This signal handler is meant to be registered for
+    RegistrationProfile with `approvals.registry.approval_handlers`,
+    or connected to the `approvals.models.approval_acted_on`
+    signal. It indicates that a
+    specific Approval object (the `sender` argument) has been acted
+    upon. This function checks to see if the object that is being
+    approved or not is a registration.models.RegistrationProfile. If
+    it is and if it was approved we invoke the 'send_email()' method
+    on that object to send the registration email off to the
+    soon-to-be new user. If it was not approved then nothing is done.
+
+    XXX Perhaps we should have a keyword argument that indicates that
+        we should send the 'reason' message to the email address of
+        the user being denied.
+
+    Arguments:
+    - `sender`:   The approvals.models.Approval object that was acted on.
+    - `**kwargs`: The `approval_acted_on` signal has no key word
+                  arguments at this time.
+    """
+
+    # If the `needs_approval` object is not of a type that we care
+    # about, ie: not a registrations.models.RegistrationProfile
+    # object, then do nothing. We check the content type rather than
+    # the object so that we do not load objects we do not care
+    # about. When this is registered with
+    # `approvals.registry.approval_handlers` we are only called for
+    # RegistrationProfiles anyway.
+    #
+    profile_type = ContentType.objects.get_for_model(RegistrationProfile)
+    if sender.content_type_id != profile_type.id:
+        return
+
+    # We break out 'none' 'false'  and 'true' cases so that we can
+    # send different messages.
+    #
+    if sender.approved is None:
+        message = _("No approval action taken for %s") % \
+            sender.needs_approval
+    elif sender.approved is False:
+        message = _("Approval denied for %s") % sender.needs_approval
+    else:
+        # Finally, we know this is a successful approval for a
+        # registration profile. Make our user-to-be happy.
+        #
+        sender.needs_approval.send_email()
+        message = _("Account for '%s' was approved.") % \
+            sender.needs_approval
+
+    sender.acted_on_by.message_set.create(message = message)
+    return
+
+####################################################################
+#
+def register_users(sender, approvals, **kwargs):
+    """
+    This signal handler is meant to be registered for
+    RegistrationProfile with
+    `approval_handlers.register_batch()` (see
+    `approvals.registry`), or connected to the
+    `approvals.models.approvals_acted_on_batch` signal. It does for
+    a whole batch of decided approvals what `register_user` does
+    for one: every approved registration.models.RegistrationProfile
+    gets its activation email.
+
+    The activation emails are rendered from the same templates that
+    `RegistrationProfile.send_email()` uses but are all sent over a
+    single connection to the mail server. The user that acted on
+    the approvals gets one message summing up the batch instead of
+    one message per approval.
+
+    Arguments:
+    - `sender`:    The approvals.models.Approval class.
+    - `approvals`: The list of approvals.models.Approval objects that
+                   were acted on.
+    - `**kwargs`:  Any other arguments of the signal.
+    """
+    profile_type = ContentType.objects.get_for_model(RegistrationProfile)
+    approvals = [a for a in approvals
+                 if a.content_type_id == profile_type.id]
+    if not approvals:
+        return
+    profiles = [a.needs_approval for a in prefetch_targets(approvals)
+                if a.needs_approval is not None]
+    if not profiles:
+        return
+
+    # All of the approvals in a batch are decided the same way by
+    # the same user.
+    #
+    approval = approvals[0]
+    if approval.approved:
+        # The profiles were fetched with their users, see the end of
+        # this module.
+        #
+        current_site = Site.objects.get_current()
+        subject = render_to_string(
+            'registration/activation_email_subject.txt',
+            { 'site': current_site })
+        # Email subject *must not* contain newlines
+        subject = ''.join(subject.splitlines())
+
+        messages = []
+        for profile in profiles:
+            message = render_to_string(
+                'registration/activation_email.txt',
+                { 'activation_key': profile.activation_key,
+                  'expiration_days': settings.ACCOUNT_ACTIVATION_DAYS,
+                  'site': current_site })
+            messages.append(EmailMessage(subject, message,
+                                         settings.DEFAULT_FROM_EMAIL,
+                                         [profile.user.email]))
+        report = mail.deliver(messages)
+        if report.failures and not report.sent:
+            raise mail.DeliveryError(report)
+        message = _("%d accounts were approved.") % len(profiles)
+    else:
+        message = _("Approval denied for %d accounts.") % len(profiles)
+
+    if approval.acted_on_by is not None:
+        approval.acted_on_by.message_set.create(message = message)
+    return
+
+# Send the activation emails when registrations are approved, one at a
+# time or in a batch. The registry only calls these for
+# RegistrationProfile approvals.
+#
+approval_handlers.register(RegistrationProfile, register_user)
+approval_handlers.register_batch(RegistrationProfile, register_users)
+
+# Fetch the profiles along with their users, which is what
+# `RegistrationProfile.__unicode__()` shows, when listing approvals of
+# them and when sending a batch of activation emails.
+#
+approval_handlers.register_targets(
+    RegistrationProfile, RegistrationProfile.objects.select_related('user'))
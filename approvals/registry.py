@@ -0,0 +1,232 @@
+#
+# File: $Id$
+#
+"""
+A registry of the handlers that want to hear about decisions on
+approvals for particular models.
+
+Connecting a receiver straight to `approval_acted_on` means it is run
+for every approval that is decided and has to load the approval's
+`needs_approval` object just to find out whether it cares. Handlers
+registered here are only run for approvals of the model they were
+registered for. The lookup uses the approval's `content_type_id`
+and the ContentType cache, so an approval that no handler is
+interested in never has its target loaded:
+
+    from approvals.registry import approval_handlers
+
+    approval_handlers.register(RegistrationProfile, register_user)
+    approval_handlers.register_batch(RegistrationProfile, register_users)
+
+The objects that approvals are for are fetched in bulk whenever
+approvals are listed (see `approvals.models.prefetch_targets()`). A
+module can also say which queryset to fetch the objects of its model
+from, so that what their `__unicode__()` shows comes along with them:
+
+    approval_handlers.register_targets(
+        RegistrationProfile, RegistrationProfile.objects.select_related('user'))
+
+Handlers are called exactly as receivers of `approval_acted_on` and
+`approvals_acted_on_batch` are, except that a batch handler is only
+given the approvals for its model. How long each handler takes is
+reported to the metrics backend (see `approvals.metrics`) as
+'approvals.handlers.<module>.<handler>'.
+
+The registry is connected to the signals by `approvals.models`, so it
+runs in every process that decides approvals or delivers the outbox:
+the web server, the 'process_approval_outbox' worker and commands such
+as 'expire_approvals'. Register your handlers at the top level of a
+module and name it in the `APPROVALS_HANDLER_MODULES` setting; the
+modules are imported the first time a decision is dispatched, in
+whichever process that is. By default it is
+'approvals.registration_support' if 'registration' is in
+INSTALLED_APPS and nothing otherwise.
+"""
+
+# Django imports
+#
+from django.conf import settings
+from django.utils.importlib import import_module
+
+# Model imports
+#
+from django.contrib.contenttypes.models import ContentType
+
+# Approvals imports
+#
+from approvals.metrics import timer, receiver_name
+
+####################################################################
+#
+def model_key(model_or_content_type):
+    """
+    The key we file handlers under: the (app label, model name) of a
+    model class or ContentType. This is the same for both, so we can
+    map an approval's content type to its handlers without importing
+    or even knowing about the model.
+    """
+    if isinstance(model_or_content_type, ContentType):
+        return (model_or_content_type.app_label, model_or_content_type.model)
+    opts = model_or_content_type._meta
+    return (opts.app_label, opts.object_name.lower())
+
+####################################################################
+#
+def handler_modules():
+    """
+    The names of the modules that register handlers, from the
+    `APPROVALS_HANDLER_MODULES` setting.
+    """
+    default = ()
+    if 'registration' in settings.INSTALLED_APPS:
+        default = ('approvals.registration_support',)
+    return getattr(settings, 'APPROVALS_HANDLER_MODULES', default)
+
+####################################################################
+#
+class ApprovalHandlers(object):
+    """
+    Handlers for decided approvals, filed by the model of the object
+    that the approval is for.
+    """
+
+    ####################################################################
+    #
+    def __init__(self):
+        self._handlers = {}
+        self._batch_handlers = {}
+        self._targets = {}
+        self._loaded = False
+
+    ####################################################################
+    #
+    def load(self):
+        """
+        Import the modules named by `APPROVALS_HANDLER_MODULES`, once,
+        so that the handlers they register are there no matter which
+        of the app's modules this process happened to import.
+        """
+        if self._loaded:
+            return
+        for name in handler_modules():
+            import_module(name)
+        self._loaded = True
+        return
+
+    ####################################################################
+    #
+    def register(self, model, handler):
+        """
+        Call `handler` whenever an approval for an object of `model` is
+        acted on with `Approval.approve()`.
+
+        Arguments:
+        - `model`: A model class or ContentType.
+        - `handler`: A callable taking the same arguments as a receiver
+                     of `approval_acted_on`.
+        """
+        handlers = self._handlers.setdefault(model_key(model), [])
+        if handler not in handlers:
+            handlers.append(handler)
+        return
+
+    ####################################################################
+    #
+    def register_batch(self, model, handler):
+        """
+        Call `handler` whenever approvals for objects of `model` are
+        decided as a batch with `ApprovalQuerySet.decide()`.
+
+        Arguments:
+        - `model`: A model class or ContentType.
+        - `handler`: A callable taking the same arguments as a receiver
+                     of `approvals_acted_on_batch`.
+        """
+        handlers = self._batch_handlers.setdefault(model_key(model), [])
+        if handler not in handlers:
+            handlers.append(handler)
+        return
+
+    ####################################################################
+    #
+    def register_targets(self, model, queryset):
+        """
+        Fetch the objects of `model` that approvals are for from
+        `queryset` when they are fetched in bulk, for instance with
+        the `select_related()` of what their `__unicode__()` shows.
+
+        Arguments:
+        - `model`: A model class or ContentType.
+        - `queryset`: A queryset of the objects of `model`.
+        """
+        self._targets[model_key(model)] = queryset
+        return
+
+    ####################################################################
+    #
+    def targets_for(self, model):
+        """
+        Return the queryset to fetch the objects of `model` that
+        approvals are for from: the one registered for it or its
+        default manager.
+        """
+        self.load()
+        queryset = self._targets.get(model_key(model))
+        if queryset is None:
+            return model._default_manager.all()
+        return queryset
+
+    ####################################################################
+    #
+    def handlers_for(self, content_type_id, batch = False):
+        """
+        Return the list of handlers registered for approvals of the
+        given content type.
+        """
+        self.load()
+        registry = batch and self._batch_handlers or self._handlers
+        if not registry:
+            return []
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        return registry.get(model_key(content_type), [])
+
+    ####################################################################
+    #
+    def dispatch(self, sender, **kwargs):
+        """
+        Receiver for `approval_acted_on` that calls the handlers
+        registered for the model of the approval that was acted on.
+        """
+        for handler in self.handlers_for(sender.content_type_id):
+            with timer('approvals.handlers.%s' % receiver_name(handler)):
+                handler(sender = sender, **kwargs)
+        return
+
+    ####################################################################
+    #
+    def dispatch_batch(self, sender, approvals, **kwargs):
+        """
+        Receiver for `approvals_acted_on_batch` that calls the handlers
+        registered for each model with the approvals for that model.
+        The targets of those approvals are fetched in bulk first, and
+        only for the models that have handlers.
+        """
+        # Imported here because approvals.models imports us.
+        #
+        from approvals.models import prefetch_targets
+
+        by_ct = {}
+        for approval in approvals:
+            by_ct.setdefault(approval.content_type_id, []).append(approval)
+
+        for ct_id, group in by_ct.iteritems():
+            handlers = self.handlers_for(ct_id, batch = True)
+            if not handlers:
+                continue
+            prefetch_targets(group)
+            for handler in handlers:
+                with timer('approvals.handlers.%s' % receiver_name(handler)):
+                    handler(sender = sender, approvals = group, **kwargs)
+        return
+
+approval_handlers = ApprovalHandlers()
@@ -0,0 +1,21 @@
+-- Indexes for the approvals_approval table that can not be expressed
+-- with the model field options. Django runs this after creating the
+-- table during 'syncdb'.
+
+-- The pending approval queue: Approval.objects.pending_page() filters
+-- on approved IS NULL and content_type_id and walks (created, id).
+--
+CREATE INDEX approvals_approval_pending_queue
+    ON approvals_approval (approved, content_type_id, created, id);
+
+-- Looking up the approvals for given objects:
+-- Approval.objects.status_map() and history_for().
+--
+CREATE INDEX approvals_approval_target
+    ON approvals_approval (content_type_id, object_id);
+
+-- The same for objects whose primary key is not an integer and so is
+-- kept in object_key instead of object_id.
+--
+CREATE INDEX approvals_approval_target_key
+    ON approvals_approval (content_type_id, object_key);
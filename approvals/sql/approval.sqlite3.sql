@@ -0,0 +1,13 @@
+-- At most one pending approval per object, which is what lets
+-- Approval.objects.request_approval() and request_many() be called
+-- again for an object without creating a second approval for it.
+-- Partial indexes are not available on every backend, which is why
+-- these are kept apart from the indexes in 'approval.sql'.
+--
+CREATE UNIQUE INDEX approvals_approval_one_pending
+    ON approvals_approval (content_type_id, object_id)
+    WHERE approved IS NULL AND object_id IS NOT NULL;
+
+CREATE UNIQUE INDEX approvals_approval_one_pending_key
+    ON approvals_approval (content_type_id, object_key)
+    WHERE approved IS NULL AND object_key IS NOT NULL;
@@ -0,0 +1,15 @@
+-- Indexes for the approvals_archivedapproval table that can not be
+-- expressed with the model field options. Django runs this after
+-- creating the table during 'syncdb'.
+
+-- Looking up the archived approvals for given objects:
+-- Approval.objects.status_map() and history_for().
+--
+CREATE INDEX approvals_archivedapproval_target
+    ON approvals_archivedapproval (content_type_id, object_id);
+
+-- The same for objects whose primary key is not an integer and so is
+-- kept in object_key instead of object_id.
+--
+CREATE INDEX approvals_archivedapproval_target_key
+    ON approvals_archivedapproval (content_type_id, object_key);
@@ -0,0 +1,120 @@
+#
+# File: $Id$
+#
+"""
+Template tags for the approvals app.
+
+Load them with:
+
+    {% load approvals_tags %}
+"""
+
+# Django imports
+#
+from django import template
+
+# Model imports
+#
+from approvals.models import Approval, PendingCount
+
+register = template.Library()
+
+####################################################################
+#
+class PendingApprovalCountsNode(template.Node):
+    def __init__(self, var_name):
+        self.var_name = var_name
+
+    def render(self, context):
+        counts = PendingCount.objects.counts()
+        context[self.var_name] = sorted(counts.items(),
+                                        key = lambda x: unicode(x[0]))
+        return ''
+
+####################################################################
+#
+@register.tag
+def pending_approval_counts(parser, token):
+    """
+    Put the number of pending approvals of each type in to the context
+    as a list of (content type, count) pairs. This reads the cached
+    counters, not the approvals table, so it is fine to use on every
+    page, for instance for a badge in a staff header:
+
+        {% pending_approval_counts as counts %}
+        {% for content_type, count in counts %}
+          {{ content_type }}: {{ count }}
+        {% endfor %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 3 or bits[1] != 'as':
+        raise template.TemplateSyntaxError("'%s' tag takes the form: "
+                                           "{%% %s as varname %%}" % \
+                                               (bits[0], bits[0]))
+    return PendingApprovalCountsNode(bits[2])
+
+####################################################################
+#
+class ApprovalStatusesNode(template.Node):
+    def __init__(self, objects, var_name):
+        self.objects = template.Variable(objects)
+        self.var_name = var_name
+
+    def render(self, context):
+        objects = list(self.objects.resolve(context))
+
+        # Remember what we looked up on the request so that using the
+        # tag again during the same request, say from an included
+        # template, does not repeat the queries.
+        #
+        request = context.get('request')
+        memo = getattr(request, '_approval_statuses', None)
+        if memo is None:
+            memo = {}
+            if request is not None:
+                request._approval_statuses = memo
+        missing = [obj for obj in objects if obj not in memo]
+        if missing:
+            memo.update(Approval.objects.status_map(missing))
+
+        context[self.var_name] = dict([(obj, memo[obj]) for obj in objects])
+        return ''
+
+####################################################################
+#
+@register.tag
+def approval_statuses(parser, token):
+    """
+    Look up the latest approval for each of a list of objects with
+    `Approval.objects.status_map()` and put the resulting dictionary in
+    to the context. Use the `approval_for` filter to get at the
+    approval for an object:
+
+        {% approval_statuses for object_list as statuses %}
+        {% for user in object_list %}
+          {{ user }}: {{ statuses|approval_for:user }}
+        {% endfor %}
+
+    If the 'request' is in the context (see the
+    'django.core.context_processors.request' context processor) the
+    lookups are remembered for the rest of the request.
+    """
+    bits = token.split_contents()
+    if len(bits) != 5 or bits[1] != 'for' or bits[3] != 'as':
+        raise template.TemplateSyntaxError(
+            "'%s' tag takes the form: {%% %s for objects as varname %%}" % \
+                (bits[0], bits[0]))
+    return ApprovalStatusesNode(bits[2], bits[4])
+
+####################################################################
+#
+@register.filter
+def approval_for(statuses, obj):
+    """
+    Return the approval for `obj` from a dictionary made by the
+    `approval_statuses` tag, or None if it has none.
+    """
+    try:
+        return statuses.get(obj)
+    except AttributeError:
+        return None
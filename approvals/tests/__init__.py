@@ -0,0 +1,13 @@
+#
+# File: $Id$
+#
+"""
+Tests for the approvals app. Run them with:
+
+    ./manage.py test approvals
+
+They need django.contrib.sessions, as the test client's logins do.
+"""
+
+from approvals.tests.test_models import *
+from approvals.tests.test_views import *
@@ -0,0 +1,471 @@
+#
+# File: $Id$
+#
+"""
+Tests of the approvals models and the admin actions.
+
+Most of the objects being approved are auth Groups. Sessions stand in
+for objects whose primary key is not an integer.
+"""
+
+# Python standard imports
+#
+import datetime
+
+# Django imports
+#
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+# Model imports
+#
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sessions.models import Session
+from approvals.models import Approval, ApprovalPolicy, ApprovalVote
+from approvals.models import ArchivedApproval
+from approvals.models import OutboxEntry, PendingCount
+from approvals.models import ApprovalAssignment, approval_acted_on
+
+# Approvals imports
+#
+from approvals.admin import approve_selected
+
+####################################################################
+#
+class ApprovalTestCase(TestCase):
+    """
+    Common set up: an approver and a content type, Group, to ask for
+    approvals of.
+    """
+
+    ####################################################################
+    #
+    def setUp(self):
+        self.approver = User.objects.create_user('approver',
+                                                 'approver@example.com',
+                                                 'secret')
+        self.approver.is_staff = True
+        self.approver.save()
+        self.group_type = ContentType.objects.get_for_model(Group)
+
+        # The database is rolled back between tests, the cache is not.
+        #
+        cache.clear()
+
+    ####################################################################
+    #
+    def group(self, name):
+        """
+        Create a group and ask for approval of it.
+        """
+        group = Group.objects.create(name = name)
+        approval, created = Approval.objects.request_approval(group)
+        return approval
+
+    ####################################################################
+    #
+    def pending(self):
+        """
+        The pending count of groups, as the counters have it.
+        """
+        return PendingCount.objects.counts().get(self.group_type, 0)
+
+####################################################################
+#
+class ApproveTests(ApprovalTestCase):
+    """
+    Deciding approvals one at a time.
+    """
+
+    ####################################################################
+    #
+    def setUp(self):
+        super(ApproveTests, self).setUp()
+        self.acted_on = []
+        approval_acted_on.connect(self.receiver)
+
+    ####################################################################
+    #
+    def tearDown(self):
+        approval_acted_on.disconnect(self.receiver)
+
+    ####################################################################
+    #
+    def receiver(self, sender, **kwargs):
+        self.acted_on.append(sender.id)
+
+    ####################################################################
+    #
+    def test_second_approve_loses(self):
+        approval = self.group('g1')
+        stale = Approval.objects.get(pk = approval.pk)
+
+        self.assertTrue(approval.approve(True, self.approver))
+        self.assertFalse(stale.approve(False, self.approver))
+        self.assertEqual(self.acted_on, [approval.id])
+        self.assertEqual(Approval.objects.get(pk = approval.pk).approved,
+                         True)
+
+    ####################################################################
+    #
+    def test_request_approval_returns_existing(self):
+        group = Group.objects.create(name = 'g1')
+        first, created = Approval.objects.request_approval(group)
+        self.assertTrue(created)
+
+        again, created = Approval.objects.request_approval(group)
+        self.assertFalse(created)
+        self.assertEqual(again.id, first.id)
+        self.assertEqual(Approval.objects.count(), 1)
+        self.assertEqual(self.pending(), 1)
+
+####################################################################
+#
+class VoteTests(ApprovalTestCase):
+    """
+    Voting on approvals whose policy needs more than one approver.
+    """
+
+    ####################################################################
+    #
+    def setUp(self):
+        super(VoteTests, self).setUp()
+        ApprovalPolicy.objects.create(content_type = self.group_type,
+                                      quorum = 2)
+        self.second = User.objects.create_user('second',
+                                               'second@example.com',
+                                               'secret')
+
+    ####################################################################
+    #
+    def test_quorum(self):
+        approval = self.group('g1')
+
+        self.assertTrue(approval.vote(True, self.approver))
+        self.assertFalse(approval.processed())
+
+        # Voting again changes the vote, it does not count twice.
+        #
+        self.assertTrue(approval.vote(True, self.approver))
+        self.assertFalse(Approval.objects.get(pk = approval.pk).processed())
+
+        self.assertTrue(approval.vote(True, self.second))
+        approval = Approval.objects.get(pk = approval.pk)
+        self.assertEqual(approval.approved, True)
+        self.assertEqual(ApprovalVote.objects.filter(
+                approval_id = approval.id).count(), 2)
+        self.assertFalse(approval.vote(True, self.second))
+
+    ####################################################################
+    #
+    def test_deny_decides(self):
+        approval = self.group('g1')
+        self.assertTrue(approval.vote(False, self.approver))
+        self.assertEqual(Approval.objects.get(pk = approval.pk).approved,
+                         False)
+
+    ####################################################################
+    #
+    def test_batch_vote_waits_for_quorum(self):
+        self.group('g1')
+        self.group('g2')
+
+        decided, waiting = Approval.objects.all().vote(True, self.approver)
+        self.assertEqual(decided, [])
+        self.assertEqual(len(waiting), 2)
+        self.assertEqual(self.pending(), 2)
+
+        decided, waiting = Approval.objects.all().vote(True, self.second)
+        self.assertEqual(len(decided), 2)
+        self.assertEqual(waiting, [])
+        self.assertEqual(self.pending(), 0)
+
+####################################################################
+#
+class AdminActionTests(ApprovalTestCase):
+    """
+    The approve and deny actions of the approvals admin.
+    """
+
+    ####################################################################
+    #
+    class ModelAdmin(object):
+        """
+        Collects the messages an action gives the user.
+        """
+        def __init__(self):
+            self.messages = []
+
+        def message_user(self, request, message):
+            self.messages.append(unicode(message))
+
+    ####################################################################
+    #
+    class Request(object):
+        def __init__(self, user):
+            self.user = user
+
+    ####################################################################
+    #
+    def test_only_approvers_vote(self):
+        # Groups get their own approver, users are left to the staff.
+        #
+        assigned = User.objects.create_user('assigned',
+                                            'assigned@example.com',
+                                            'secret')
+        policy = ApprovalPolicy.objects.create(content_type = self.group_type)
+        ApprovalAssignment.objects.create(policy = policy, user = assigned)
+        group = self.group('g1')
+        user, created = Approval.objects.request_approval(assigned)
+
+        modeladmin = self.ModelAdmin()
+        approve_selected(modeladmin, self.Request(self.approver),
+                         Approval.objects.all())
+        self.assertEqual(Approval.objects.get(pk = group.pk).approved, None)
+        self.assertEqual(Approval.objects.get(pk = user.pk).approved, True)
+        self.assertEqual(modeladmin.messages,
+                         [u"1 approvals approved.",
+                          u"1 approvals were skipped as you are not one of "
+                          u"their approvers."])
+
+        approve_selected(modeladmin, self.Request(assigned),
+                         Approval.objects.filter(id = group.id))
+        self.assertEqual(Approval.objects.get(pk = group.pk).approved, True)
+
+####################################################################
+#
+class OutboxTests(ApprovalTestCase):
+    """
+    Claiming outbox entries.
+    """
+
+    ####################################################################
+    #
+    def test_claim_once(self):
+        approval = self.group('g1')
+        entry = OutboxEntry.objects.create(kind = OutboxEntry.ACTED_ON,
+                                           approval = approval)
+        other = OutboxEntry.objects.get(pk = entry.pk)
+
+        self.assertTrue(entry.claim())
+        self.assertEqual(entry.attempts, 1)
+        self.assertFalse(other.claim())
+        self.assertEqual(OutboxEntry.objects.get(pk = entry.pk).attempts, 1)
+
+####################################################################
+#
+class PendingCountTests(ApprovalTestCase):
+    """
+    The pending counters following approvals as they are created,
+    decided and deleted.
+    """
+
+    ####################################################################
+    #
+    def test_counts(self):
+        approvals = [self.group('g%d' % i) for i in range(4)]
+        self.assertEqual(self.pending(), 4)
+
+        approvals[0].approve(True, self.approver)
+        self.assertEqual(self.pending(), 3)
+
+        Approval.objects.filter(id__in = [approvals[1].id,
+                                          approvals[2].id]).decide(
+            False, self.approver)
+        self.assertEqual(self.pending(), 1)
+
+        # Deleting a decided approval leaves the count alone, deleting
+        # a pending one takes it off.
+        #
+        Approval.objects.get(pk = approvals[0].pk).delete()
+        self.assertEqual(self.pending(), 1)
+        Approval.objects.get(pk = approvals[3].pk).delete()
+        self.assertEqual(self.pending(), 0)
+        self.assertEqual(
+            PendingCount.objects.get(content_type = self.group_type).count,
+            Approval.objects.filter(approved = None).count())
+
+    ####################################################################
+    #
+    def test_decide_more_ids_than_a_statement_takes(self):
+        Approval.objects.request_many(
+            [Group.objects.create(name = 'g%d' % i) for i in range(1100)])
+        first = list(Approval.objects.values_list('id', flat = True)[:5])
+        Approval.objects.filter(id__in = first).decide(False, self.approver)
+
+        decided = Approval.objects.all().decide(True, self.approver)
+        self.assertEqual(len(decided), 1095)
+        self.assertEqual(self.pending(), 0)
+
+####################################################################
+#
+class ArchiveTests(ApprovalTestCase):
+    """
+    Moving decided approvals to the archive.
+    """
+
+    ####################################################################
+    #
+    def decided(self, name):
+        """
+        Create a decided approval whose new approval notification has
+        been delivered.
+        """
+        approval = self.group(name)
+        approval.approve(True, self.approver)
+        OutboxEntry.objects.update(status = OutboxEntry.SENT)
+        return approval
+
+    ####################################################################
+    #
+    def test_ids_are_not_reused(self):
+        first = self.decided('g1')
+        second = self.decided('g2')
+
+        # The newest approval stays behind so its id is not handed out
+        # again.
+        #
+        self.assertEqual(ArchivedApproval.objects.archive([first.id,
+                                                           second.id]), 1)
+        self.assertEqual(list(Approval.objects.values_list('id', flat = True)),
+                         [second.id])
+
+        third = self.decided('g3')
+        self.assertTrue(third.id > second.id)
+        self.assertEqual(ArchivedApproval.objects.archive([second.id,
+                                                           third.id]), 1)
+        self.assertEqual(
+            sorted(ArchivedApproval.objects.values_list('id', flat = True)),
+            [first.id, second.id])
+
+    ####################################################################
+    #
+    def test_pending_and_busy_stay(self):
+        pending = self.group('g1')
+        batch = self.group('g2')
+        Approval.objects.filter(id = batch.id).decide(True, self.approver)
+        self.decided('g3')
+        OutboxEntry.objects.create(kind = OutboxEntry.ACTED_ON_BATCH,
+                                   payload = '[%d]' % batch.id)
+
+        self.assertEqual(ArchivedApproval.objects.archive(
+                [pending.id, batch.id]), 0)
+
+        OutboxEntry.objects.update(status = OutboxEntry.SENT)
+        self.assertEqual(ArchivedApproval.objects.archive(
+                [pending.id, batch.id]), 1)
+        self.assertEqual(ArchivedApproval.objects.get().id, batch.id)
+
+    ####################################################################
+    #
+    def test_votes_go_with_the_approval(self):
+        ApprovalPolicy.objects.create(content_type = self.group_type,
+                                      quorum = 2)
+        other = User.objects.create_user('other', 'other@example.com',
+                                         'secret')
+        approval = self.group('g1')
+        approval.vote(True, self.approver)
+        approval.vote(True, other)
+        OutboxEntry.objects.update(status = OutboxEntry.SENT)
+        kept = self.group('g2')
+        kept.vote(True, self.approver)
+        self.decided('g3')
+
+        self.assertEqual(ArchivedApproval.objects.archive([approval.id]), 1)
+        self.assertEqual(list(ApprovalVote.objects.values_list(
+                    'approval_id', flat = True)), [kept.id])
+
+    ####################################################################
+    #
+    def test_command_carries_on(self):
+        ids = [self.decided('g%d' % i).id for i in range(5)]
+        Approval.objects.update(modified = datetime.datetime(2000, 1, 1))
+
+        # As if an earlier run had stopped after its first chunk.
+        #
+        ArchivedApproval.objects.archive(ids[:2])
+        call_command('archive_approvals', chunk_size = 2, verbosity = 0)
+        self.assertEqual(
+            sorted(ArchivedApproval.objects.values_list('id', flat = True)),
+            ids[:4])
+        self.assertEqual(list(Approval.objects.values_list('id', flat = True)),
+                         ids[4:])
+
+        call_command('archive_approvals', chunk_size = 2, verbosity = 0)
+        self.assertEqual(ArchivedApproval.objects.count(), 4)
+
+    ####################################################################
+    #
+    def test_more_ids_than_a_statement_takes(self):
+        Approval.objects.request_many(
+            [Group.objects.create(name = 'g%d' % i) for i in range(1100)])
+        Approval.objects.all().decide(True, self.approver)
+        OutboxEntry.objects.update(status = OutboxEntry.SENT)
+        ids = list(Approval.objects.values_list('id', flat = True))
+
+        self.assertEqual(ArchivedApproval.objects.archive(ids), len(ids) - 1)
+        self.assertEqual(self.pending(), 0)
+
+####################################################################
+#
+class ObjectKeyTests(ApprovalTestCase):
+    """
+    Approvals of objects whose primary key is not an integer, which is
+    kept in 'object_key' instead of 'object_id'.
+    """
+
+    ####################################################################
+    #
+    def session(self, key):
+        return Session.objects.create(
+            session_key = key, session_data = '',
+            expire_date = datetime.datetime.now())
+
+    ####################################################################
+    #
+    def test_request_and_fetch(self):
+        session = self.session('k1')
+        approval, created = Approval.objects.request_approval(session)
+        approval = Approval.objects.get(pk = approval.pk)
+        self.assertEqual(approval.object_id, None)
+        self.assertEqual(approval.object_key, 'k1')
+        self.assertEqual(approval.needs_approval, session)
+
+        again, created = Approval.objects.request_approval(session)
+        self.assertFalse(created)
+        self.assertEqual(again.id, approval.id)
+
+    ####################################################################
+    #
+    def test_many_and_in_bulk(self):
+        sessions = [self.session('k%d' % i) for i in range(3)]
+        group = Group.objects.create(name = 'g1')
+        Approval.objects.request_approval(sessions[0])
+        Approval.objects.request_many(sessions + [group])
+        self.assertEqual(Approval.objects.count(), 4)
+
+        targets = [a.needs_approval for a in Approval.objects.with_targets()]
+        self.assertEqual(set(targets), set(sessions + [group]))
+
+        statuses = Approval.objects.status_map(sessions + [group])
+        self.assertEqual(sorted([a.object_key for s, a in statuses.items()
+                                 if isinstance(s, Session)]),
+                         ['k0', 'k1', 'k2'])
+
+    ####################################################################
+    #
+    def test_archived(self):
+        session = self.session('k1')
+        approval, created = Approval.objects.request_approval(session)
+        approval.approve(True, self.approver)
+        OutboxEntry.objects.update(status = OutboxEntry.SENT)
+        self.group('g1')
+
+        self.assertEqual(ArchivedApproval.objects.archive([approval.id]), 1)
+        archived = ArchivedApproval.objects.get(pk = approval.id)
+        self.assertEqual(archived.needs_approval, session)
+        self.assertEqual([a.id for a in
+                          Approval.objects.history_for(session)],
+                         [approval.id])
@@ -0,0 +1,188 @@
+#
+# File: $Id$
+#
+"""
+Tests of the approvals views: the page cache of 'act_on_approval' and
+the conditional GETs and permission checks of the JSON API.
+"""
+
+# Python standard imports
+#
+import os
+
+# Django imports
+#
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+
+# Model imports
+#
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from approvals.models import Approval, ApprovalPolicy, ApprovalAssignment
+
+# Approvals imports
+#
+from approvals.tests.test_models import ApprovalTestCase
+
+# The templates the views are rendered with in these tests.
+#
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'templates')
+
+####################################################################
+#
+class ViewTestCase(ApprovalTestCase):
+    """
+    Common set up for the view tests: the test URLConf and templates
+    and a client logged in as the approver.
+    """
+    urls = 'approvals.tests.urls'
+
+    ####################################################################
+    #
+    def setUp(self):
+        super(ViewTestCase, self).setUp()
+        self.template_dirs = settings.TEMPLATE_DIRS
+        settings.TEMPLATE_DIRS = (TEMPLATE_DIR,)
+        self.client = Client()
+        self.client.login(username = 'approver', password = 'secret')
+
+    ####################################################################
+    #
+    def tearDown(self):
+        settings.TEMPLATE_DIRS = self.template_dirs
+        super(ViewTestCase, self).tearDown()
+
+####################################################################
+#
+class ActOnCacheTests(ViewTestCase):
+    """
+    Caching the 'act_on_approval' page of processed approvals.
+    """
+
+    ####################################################################
+    #
+    def reason_shown(self, url, approval):
+        """
+        Change the reason of `approval` without touching its modified
+        time, which is what the cache key has, and return the reason
+        the page at `url` shows.
+        """
+        Approval.objects.filter(pk = approval.pk).update(
+            reason = "changed")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.content.split('\n')[0]
+
+    ####################################################################
+    #
+    def test_processed_page_is_cached(self):
+        approval = self.group('g1')
+        approval.approve(True, self.approver, "first")
+        url = reverse('approvals_act_on', args = [approval.id])
+
+        self.assertTrue("first" in self.client.get(url).content)
+        self.assertEqual(self.reason_shown(url, approval), "first")
+
+        # Saving the approval changes its modified time and so the key.
+        #
+        Approval.objects.get(pk = approval.pk).save()
+        self.assertEqual(self.client.get(url).content.split('\n')[0],
+                         "changed")
+
+    ####################################################################
+    #
+    def test_pending_page_is_not_cached(self):
+        approval = self.group('g1')
+        url = reverse('approvals_act_on', args = [approval.id])
+        self.client.get(url)
+        self.assertEqual(self.reason_shown(url, approval), "changed")
+
+    ####################################################################
+    #
+    def test_page_with_csrf_token_is_not_cached(self):
+        approval = self.group('g1')
+        approval.approve(True, self.approver, "first")
+        url = reverse('approvals_test_act_on_csrf', args = [approval.id])
+
+        response = self.client.get(url)
+        self.assertTrue('csrfmiddlewaretoken' in response.content)
+        self.assertEqual(self.reason_shown(url, approval), "changed")
+
+####################################################################
+#
+class ApiTests(ViewTestCase):
+    """
+    The JSON API's ETags and its checks of who may vote.
+    """
+
+    ####################################################################
+    #
+    def test_detail_not_modified(self):
+        approval = self.group('g1')
+        url = reverse('approvals_api_detail', args = [approval.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        approval.approve(True, self.approver)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    ####################################################################
+    #
+    def test_list_not_modified(self):
+        first = self.group('g1')
+        self.group('g2')
+        url = reverse('approvals_api_list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+        etag = response['ETag']
+
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH = etag).status_code, 304)
+
+        # Deciding an approval takes it out of the queue, which is a
+        # change even though nothing in the queue was modified.
+        #
+        first.approve(True, self.approver)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        self.group('g3')
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH = etag).status_code, 200)
+
+    ####################################################################
+    #
+    def test_decision_needs_an_approver(self):
+        # 'other' approves users, not the groups the staff approve.
+        #
+        other = User.objects.create_user('other', 'other@example.com',
+                                         'secret')
+        policy = ApprovalPolicy.objects.create(
+            content_type = ContentType.objects.get_for_model(User))
+        ApprovalAssignment.objects.create(policy = policy, user = other)
+        approval = self.group('g1')
+        url = reverse('approvals_api_decision', args = [approval.id])
+
+        client = Client()
+        client.login(username = 'other', password = 'secret')
+        response = client.post(url, { 'approved' : 'True' })
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Approval.objects.get(pk = approval.pk).approved,
+                         None)
+
+        response = self.client.post(url, { 'approved' : 'True' })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Approval.objects.get(pk = approval.pk).approved,
+                         True)
@@ -0,0 +1,22 @@
+#
+# File: $Id$
+#
+"""
+URLConf for the tests of the approvals views: the app's own URLs and
+the 'act_on_approval' view with a template that always shows the CSRF
+token.
+"""
+from django.conf.urls.defaults import *
+from approvals.decorators import is_approver
+from approvals.views import act_on_approval
+
+###########################################################################
+#
+urlpatterns = patterns(
+    '',
+    url(r'^csrf/(?P<object_id>\d+)/act_on/$',
+        is_approver(act_on_approval),
+        { 'template_name': 'approvals/act_on_approval_csrf.html' },
+        name='approvals_test_act_on_csrf'),
+    (r'^', include('approvals.urls')),
+    )
@@ -7,18 +7,37 @@ URLConf to include this URLConf for any URL beginning with
 
 """
 from django.conf.urls.defaults import *
-from django.views.generic.list_detail import object_list
-from approvals.views import act_on_approval
-from approvals.decorators import is_staff
-
-from approvals.models import Approval
+from approvals.views import act_on_approval, act_on_approvals
+from approvals.views import pending_approvals, export_approvals
+from approvals.api import approval_list, approval_detail, approval_decision
+from approvals.decorators import is_approver, is_staff
 
 ###########################################################################
 #
 urlpatterns = patterns(
     '',
     url(r'^(?P<object_id>\d+)/act_on/$',
-        is_staff(act_on_approval),
+        is_approver(act_on_approval),
         { 'template_name': 'approvals/act_on_approval.html' },
         name='approvals_act_on'),
+    url(r'^pending/$',
+        is_approver(pending_approvals),
+        { 'template_name': 'approvals/pending_approvals.html' },
+        name='approvals_pending'),
+    url(r'^act_on/$',
+        is_approver(act_on_approvals),
+        { 'template_name': 'approvals/act_on_approvals.html' },
+        name='approvals_act_on_many'),
+    url(r'^api/pending/$',
+        is_approver(approval_list),
+        name='approvals_api_list'),
+    url(r'^api/(?P<object_id>\d+)/$',
+        is_approver(approval_detail),
+        name='approvals_api_detail'),
+    url(r'^api/(?P<object_id>\d+)/decision/$',
+        is_approver(approval_decision),
+        name='approvals_api_decision'),
+    url(r'^export/$',
+        is_staff(export_approvals),
+        name='approvals_export'),
     )
@@ -0,0 +1,48 @@
+#
+# File: $Id$
+#
+"""
+Small helpers shared by the various parts of the approvals app.
+"""
+
+# Python standard imports
+#
+from functools import wraps
+
+# Django imports
+#
+from django.db import transaction
+from django.utils.importlib import import_module
+
+####################################################################
+#
+def atomic(func):
+    """
+    Decorator that runs `func` inside a transaction that is committed
+    when `func` returns and rolled back if it raises.
+
+    If the caller is already managing the transaction (for instance
+    through the TransactionMiddleware or their own
+    `commit_on_success`) we leave it alone and simply call `func`, so
+    that the work becomes part of the caller's transaction instead of
+    committing it out from under them.
+    """
+    managed = transaction.commit_on_success(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if transaction.is_managed():
+            return func(*args, **kwargs)
+        return managed(*args, **kwargs)
+    return wrapper
+
+####################################################################
+#
+def load_object(path):
+    """
+    Import and return the object named by the dotted `path`, such as
+    'approvals.metrics.NullMetrics', as used by the settings that name
+    a class or function.
+    """
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)
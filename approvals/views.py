@@ -2,27 +2,95 @@
 # File: $Id: views.py 11 2008-09-29 06:25:36Z scanner $
 #
 
+# Python standard imports
+import datetime
+from hashlib import md5
+
 # Django imports
 from django.conf import settings
+from django.core.cache import cache
 from django.http import HttpResponseRedirect
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseForbidden
+from django.http import HttpResponseBadRequest
 from django.shortcuts import render_to_response
 from django.shortcuts import get_object_or_404
 from django.template.loader import get_template
 from django.template import RequestContext
 from django.core.urlresolvers import reverse
+from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import ugettext_lazy as _
 
 # Form imports
 #
-from approvals.forms import ApprovalForm
+from approvals.forms import ApprovalForm, BatchApprovalForm
 
 # Model imports
 #
-from approvals.models import Approval
+from approvals.models import Approval, ArchivedApproval
+
+# Approvals imports
+#
+from approvals import export, recipients
+from approvals.metrics import timed
+
+# The format of the 'created' half of a pending queue cursor.
+#
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+#############################################################################
+#
+def encode_cursor(cursor):
+    """
+    Turn a (created, id) cursor as returned by
+    `Approval.objects.pending_page()` in to a string that can be put
+    in a URL.
+    """
+    created, id = cursor
+    return "%s_%d" % (created.strftime(CURSOR_DATE_FORMAT), id)
 
 #############################################################################
 #
+def decode_cursor(value):
+    """
+    The reverse of `encode_cursor()`. Returns None if `value` is not a
+    valid cursor, in which case the caller should start at the first
+    page.
+    """
+    try:
+        created, id = value.split('_')
+        return (datetime.datetime.strptime(created, CURSOR_DATE_FORMAT),
+                int(id))
+    except (ValueError, AttributeError):
+        return None
+
+#############################################################################
+#
+def act_on_cache_key(request, approval, template_name):
+    """
+    The cache key for the page `act_on_approval` renders for a processed
+    approval. The page shows the user it is rendered for so that is
+    part of the key. So is the approval's 'modified' time, which
+    changes every time it is saved or decided, so a cached page is
+    never served for an approval that has changed since.
+
+    Arguments:
+    - `request`: Django request object.
+    - `approval`: The processed Approval or ArchivedApproval.
+    - `template_name`: Path to the template the page is rendered with.
+    """
+    key = "%s:%d:%s:%s:%s" % (approval._meta.object_name, approval.id,
+                              approval.modified.isoformat(),
+                              request.user.id, template_name)
+
+    # 'csrf' marks the keys of pages that were checked for a CSRF token
+    # before being cached (see `act_on_approval`), so pages cached
+    # before that check are never served.
+    #
+    return 'approvals.views.act_on_approval.csrf.%s' % md5(key).hexdigest()
+
+#############################################################################
+#
+@timed('approvals.views.act_on_approval')
 def act_on_approval(request, object_id,
                     template_name = 'approvals/act_on_approval.html',
                     form_class = ApprovalForm,
@@ -37,39 +105,247 @@ def act_on_approval(request, object_id,
     - `object_id`: The id of the approval object to view.
     - `template_name`: Path to the template to use.
     - `extra_context`: Dictionary of extra context data to pass to the template.
+
+    Approvals that have been moved to the archive are still shown, but
+    as they have been acted on already there is nothing to post.
+
+    Posting the form casts the user's vote with `Approval.vote()`,
+    which decides the approval when its policy says so. Users that are
+    not approvers of the approval's content type get '403 Forbidden'.
+
+    Processed approvals do not change again, so the page for one is
+    cached for `APPROVALS_ACT_ON_CACHE_TIMEOUT` seconds (default one
+    hour) and served without looking up the approval's target or
+    rendering the template. The page is rendered as usual when the user
+    has messages waiting to be shown on it. Pages that use the CSRF
+    token, with a '{% csrf_token %}' anywhere in the template, are not
+    cached: the token belongs to the browser the page was rendered for
+    and rendering it is what sets the CSRF cookie.
     """
-    object = get_object_or_404(Approval, pk = object_id)
+    try:
+        object = Approval.objects.get(pk = object_id)
+    except Approval.DoesNotExist:
+        object = get_object_or_404(ArchivedApproval, pk = object_id)
 
     # See if an approval is being acted upon by the approval form being
     # posted. If we have a valid approval form then invoke the approve method
     # on our object with the approval status and reason from the form.
     #
     if request.method == 'POST':
+        if not recipients.is_approver(request.user, object.content_type_id):
+            return HttpResponseForbidden()
         form = form_class(request.POST)
-        if form.is_valid():
+        if form.is_valid() and form.cleaned_data['approved'] is not None:
             if 'reason' in form.cleaned_data:
                 reason = form.cleaned_data['reason']
             else:
                 reason = None
 
-            object.approve(form.cleaned_data['approved'], request.user, reason)
+            if isinstance(object, Approval):
+                counted = object.vote(form.cleaned_data['approved'],
+                                      request.user, reason)
+            else:
+                counted = False
 
             if request.user.is_authenticated():
-                request.user.message_set.create(message = _("Approval '%s' "
-                                                            "processed") % \
-                                                    object)
+                if not counted:
+                    message = _("Approval '%s' was already processed by "
+                                "someone else") % object
+                elif object.processed():
+                    message = _("Approval '%s' processed") % object
+                else:
+                    message = _("Your vote on approval '%s' has been "
+                                "recorded") % object
+                request.user.message_set.create(message = message)
             return HttpResponseRedirect(reverse('approvals_act_on',
                                                 args = [object.id]))
     else:
         form = form_class({'approved': object.approved,
                            'reason':object.reason })
 
+    if extra_context is None:
+        extra_context = {}
+    context = RequestContext(request)
+    for key, value in extra_context.items():
+        context[key] = callable(value) and value() or value
+
+    cache_key = None
+    if request.method != 'POST' and object.processed() and \
+            not context.get('messages'):
+        cache_key = act_on_cache_key(request, object, template_name)
+        content = cache.get(cache_key)
+        if content is not None:
+            return HttpResponse(content)
+
+    response = render_to_response(template_name,
+                                  { 'form'  : form,
+                                    'object': object},
+                                  context_instance=context)
+    if cache_key is not None and not request.META.get('CSRF_COOKIE_USED'):
+        cache.set(cache_key, response.content,
+                  getattr(settings, 'APPROVALS_ACT_ON_CACHE_TIMEOUT', 60 * 60))
+    return response
+
+#############################################################################
+#
+@timed('approvals.views.pending_approvals')
+def pending_approvals(request, models = None,
+                      template_name = 'approvals/pending_approvals.html',
+                      per_page = 20,
+                      extra_context = None):
+    """
+    Show a page of the approvals that are waiting on the user, oldest
+    first: the pending approvals they may act on that they have not
+    voted on yet.
+
+    The pages are walked with a cursor passed in the 'after' GET
+    parameter instead of a page number, so that deep pages of a large
+    queue are as cheap as the first one. The template gets:
+
+    - `object_list`: The approvals on this page.
+    - `has_next`: True if there is another page.
+    - `next_cursor`: The value to pass as 'after' to get the next page.
+
+    Arguments:
+    - `request`: Django request object.
+    - `models`: Optional list of model classes to restrict the queue to
+                approvals of objects of those models.
+    - `template_name`: Path to the template to use.
+    - `per_page`: The number of approvals to show on a page.
+    - `extra_context`: Dictionary of extra context data to pass to the template.
+    """
+    content_types = None
+    if models is not None:
+        # get_for_model() is served from the ContentType cache after
+        # the first lookup so this does not cost a query per request.
+        #
+        content_types = [ContentType.objects.get_for_model(m) for m in models]
+
+    after = decode_cursor(request.GET.get('after'))
+    object_list, next_cursor = Approval.objects.pending_page(
+        content_types, after, per_page, approver = request.user)
+    if next_cursor is not None:
+        next_cursor = encode_cursor(next_cursor)
+
     if extra_context is None:
         extra_context = {}
     context = RequestContext(request)
     for key, value in extra_context.items():
         context[key] = callable(value) and value() or value
     return render_to_response(template_name,
-                              { 'form'  : form,
-                                'object': object},
+                              { 'object_list' : object_list,
+                                'has_next'    : next_cursor is not None,
+                                'next_cursor' : next_cursor },
                               context_instance=context)
+
+#############################################################################
+#
+@timed('approvals.views.act_on_approvals')
+def act_on_approvals(request,
+                     template_name = 'approvals/act_on_approvals.html',
+                     form_class = BatchApprovalForm,
+                     extra_context = None):
+    """
+    Approve or deny many approvals at once. This is meant to be posted
+    to from a list of approvals, such as the pending approvals view,
+    with a checkbox for each approval.
+
+    The user's vote is cast with `ApprovalQuerySet.vote()`. Approvals
+    whose policy needs more than one approver are voted on one at a
+    time and only decided once their quorum is met; the rest are
+    decided in a single transaction and the `approvals_acted_on_batch`
+    signal is sent once for all of them. Approvals the user is not an
+    approver of are left alone.
+
+    On success we redirect to the 'next' POST parameter if it is given
+    or the pending approvals view otherwise. If the form is not valid
+    it is shown with the template.
+
+    Arguments:
+    - `request`: Django request object.
+    - `template_name`: Path to the template to use.
+    - `form_class`: The form to use; it must clean to 'approvals',
+                    'approved' and 'reason'.
+    - `extra_context`: Dictionary of extra context data to pass to the template.
+    """
+    if request.method == 'POST':
+        form = form_class(request.POST)
+        if form.is_valid():
+            reason = form.cleaned_data.get('reason') or None
+            decided, waiting = form.cleaned_data['approvals'].filter(
+                recipients.approvable_by(request.user)).vote(
+                form.cleaned_data['approved'], request.user, reason)
+
+            if request.user.is_authenticated():
+                request.user.message_set.create(message = _("%d approvals "
+                                                            "processed") % \
+                                                    len(decided))
+                if waiting:
+                    request.user.message_set.create(
+                        message = _("Your vote was recorded on %d approvals "
+                                    "that need more approvers") % \
+                            len(waiting))
+            next = request.POST.get('next') or reverse('approvals_pending')
+            return HttpResponseRedirect(next)
+    else:
+        form = form_class()
+
+    if extra_context is None:
+        extra_context = {}
+    context = RequestContext(request)
+    for key, value in extra_context.items():
+        context[key] = callable(value) and value() or value
+    return render_to_response(template_name,
+                              { 'form' : form },
+                              context_instance=context)
+
+#############################################################################
+#
+@timed('approvals.views.export_approvals')
+def export_approvals(request, chunk_size = 1000):
+    """
+    Send the history of the approvals, live and archived, as CSV or JSON
+    lines (see `approvals.export`). GET parameters:
+
+    - `format`: 'csv', the default, or 'jsonl'.
+    - `since`: Only approvals created on or after this date
+               (YYYY-MM-DD[ HH:MM:SS]).
+    - `until`: Only approvals created before this date.
+    - `after`: 'created,id' of the last row of an earlier export, to
+               carry on after it.
+    - `content_type`: 'app_label.model' of the approvals to export. May
+                      be given more than once. All types by default.
+
+    The response's content is a generator, so the export is sent as it
+    is read from the database, a chunk at a time, rather than being
+    built in memory first. Middleware that needs the whole content,
+    such as GZipMiddleware, defeats that.
+
+    Arguments:
+    - `request`: Django request object.
+    - `chunk_size`: The number of approvals to read at a time.
+    """
+    format = request.GET.get('format', 'csv')
+    if format not in export.FORMATS:
+        return HttpResponseBadRequest("Unknown format '%s'" % format,
+                                      mimetype = 'text/plain')
+    since = until = after = content_types = None
+    try:
+        if request.GET.get('since'):
+            since = export.parse_date(request.GET['since'])
+        if request.GET.get('until'):
+            until = export.parse_date(request.GET['until'])
+        if request.GET.get('after'):
+            after = export.parse_cursor(request.GET['after'])
+        if request.GET.getlist('content_type'):
+            content_types = export.parse_content_types(
+                request.GET.getlist('content_type'))
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e), mimetype = 'text/plain')
+
+    response = HttpResponse(export.export(format, export.approvals(
+                since, until, after, content_types, chunk_size)),
+                            mimetype = export.FORMATS[format])
+    response['Content-Disposition'] = 'attachment; filename=approvals.%s' % \
+        format
+    return response
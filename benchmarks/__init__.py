@@ -0,0 +1,21 @@
+#
+# File: $Id$
+#
+"""
+Benchmarks for the approvals app.
+
+These seed a database with approvals for several content types and
+time the paths that matter as the approvals table grows: creating and
+deciding approvals, delivering their notifications and the admin,
+pending queue and 'act_on_approval' pages. For each they report the
+wall time, the number of queries and the peak memory of the process,
+and they fail when a path makes more queries than the numbers recorded
+in 'baseline.json'.
+
+Run them from the top of the source tree:
+
+    python -m benchmarks.run
+
+See 'benchmarks/run.py' for the options and 'benchmarks/settings.py'
+for running them against PostgreSQL.
+"""
@@ -0,0 +1,26 @@
+#
+# File: $Id$
+#
+"""
+Email backend for the benchmarks.
+"""
+
+# Django imports
+#
+from django.core.mail.backends import locmem
+
+####################################################################
+#
+class CountingEmailBackend(locmem.EmailBackend):
+    """
+    The locmem email backend, counting the connections opened to it in
+    `connections` so that the benchmarks can check how many a delivery
+    makes.
+    """
+    connections = 0
+
+    ####################################################################
+    #
+    def open(self):
+        CountingEmailBackend.connections += 1
+        return True
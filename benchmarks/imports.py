@@ -0,0 +1,101 @@
+#
+# File: $Id$
+#
+"""
+Measure what importing the approvals app costs.
+
+    python -m benchmarks.imports [--runs N]
+
+Each run is a fresh interpreter which imports Django, the contrib apps
+and, for their translations, the installed apps first and then times
+importing 'approvals.models', 'approvals.urls' and
+'approvals.management', the modules every project using the app
+loads. We report the best time, the number of modules
+the app's imports loaded and which of the optional apps it uses,
+django-notification, django-mailer and django-registration, they
+pulled in. None of those should be imported until they are used, so if
+any of them are we say so and exit with status 1.
+"""
+
+# Python standard imports
+#
+import os
+import sys
+import time
+import subprocess
+from optparse import OptionParser
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+# The optional apps that importing approvals must not import.
+#
+OPTIONAL = ('notification', 'mailer', 'registration')
+
+# What is imported, and timed, in each run.
+#
+MODULES = ('approvals.models', 'approvals.urls', 'approvals.management')
+
+####################################################################
+#
+def measure():
+    """
+    Import the approvals app and print the time it took, the number of
+    modules it loaded and the optional apps among them. Run in the
+    child interpreter.
+    """
+    # Django imports every installed app the first time it translates
+    # something, as it looks for their catalogs; do that beforehand so
+    # that only what approvals imports is counted.
+    #
+    from django.utils import translation
+    translation.ugettext('approvals')
+    import django.db.models
+    import django.contrib.auth.models
+    import django.contrib.contenttypes.models
+    import django.contrib.sites.models
+    import django.conf.urls.defaults
+
+    before = set(sys.modules)
+    start = time.time()
+    for name in MODULES:
+        __import__(name)
+    elapsed = time.time() - start
+    loaded = [name for name in set(sys.modules) - before
+              if sys.modules[name] is not None]
+    optional = sorted([name for name in loaded
+                       if name.split('.')[0] in OPTIONAL])
+    print "%f %d %s" % (elapsed, len(loaded), ','.join(optional))
+
+####################################################################
+#
+def main():
+    parser = OptionParser(usage = "python -m benchmarks.imports [options]")
+    parser.add_option('--runs', type = 'int', default = 5,
+                      help = 'Number of fresh interpreters to time the '
+                      'imports in.')
+    parser.add_option('--child', action = 'store_true', default = False,
+                      help = 'Do one run in this interpreter.')
+    options, args = parser.parse_args()
+
+    if options.child:
+        measure()
+        return 0
+
+    times = []
+    for i in range(max(options.runs, 1)):
+        output = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.imports', '--child'],
+            stdout = subprocess.PIPE).communicate()[0].split()
+        times.append(float(output[0]))
+        count = int(output[1])
+        optional = output[2:] and output[2].split(',') or []
+
+    print "Imported %s in %.2f ms, loading %d modules" % (
+        ', '.join(MODULES), min(times) * 1000, count)
+    if optional:
+        print "IMPORTED OPTIONAL MODULES: %s" % ', '.join(optional)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,459 @@
+#
+# File: $Id$
+#
+"""
+Run the approvals benchmarks.
+
+    python -m benchmarks.run [--approvals N] [--ops N] [--update-baseline]
+
+Each benchmark does its setup, which is not measured, and then runs
+some number of operations. We report the wall time, the number of
+queries per operation and the peak resident memory of the process
+after the run. The queries per operation are compared with the ones
+recorded for the database backend in 'baseline.json'; if any
+benchmark makes more we say so and exit with status 1.
+
+The baseline holds the whole number of queries per operation, which
+does not depend on the arguments as long as '--approvals' is at least
+150 and '--ops' at least 5: the pages benchmarked then show the same
+content types and the queries made once per run add less than one per
+operation. So running with a larger '--approvals' checks that none of
+the paths make more queries as the tables grow.
+"""
+
+# Python standard imports
+#
+import os
+import sys
+import time
+import resource
+from optparse import OptionParser
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+# Django imports
+#
+from django.conf import settings
+from django.core import mail, signals
+from django.core.urlresolvers import reverse
+from django.db import connection, reset_queries
+from django.test.client import Client
+from django.utils import simplejson
+
+# Model imports
+#
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from approvals.models import Approval, OutboxEntry, PendingCount
+from approvals.models import decision_values
+from approvals import notify, recipients
+from benchmarks.backends import CountingEmailBackend
+
+try:
+    from registration.models import RegistrationProfile
+except ImportError:
+    RegistrationProfile = None
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+
+# The benchmarks, in the order they are run, as (name, function)
+# pairs. See `benchmark()`.
+#
+BENCHMARKS = []
+
+####################################################################
+#
+def benchmark(name):
+    """
+    Decorator adding a benchmark. The function is given the benchmark
+    environment, a dictionary with the 'options', a logged in staff
+    'client' and the 'approver' User. It does its setup and returns
+    a tuple of the number of operations and a callable that performs
+    them, which is what we measure. It returns None to skip the
+    benchmark.
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+####################################################################
+#
+def get(client, url):
+    """
+    GET `url` with the test client, making sure that it worked.
+    """
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError("GET %s returned %d" % (url, response.status_code))
+    return response
+
+####################################################################
+#
+def new_groups(prefix, count):
+    """
+    Create `count` groups to ask for approval of.
+    """
+    return [Group.objects.create(name = "%s %d" % (prefix, i))
+            for i in range(count)]
+
+####################################################################
+#
+def group_approvals(approved, count, newest = False):
+    """
+    Return `count` approvals for groups that are pending or, if
+    `approved` is True, have been approved. The oldest ones, unless
+    `newest` is True.
+    """
+    ct = ContentType.objects.get_for_model(Group)
+    approvals = Approval.objects.filter(content_type = ct,
+                                        approved = approved)
+    if newest:
+        approvals = approvals.order_by('-created', '-id')
+    return list(approvals[:count])
+
+####################################################################
+#
+def seed(count, approver):
+    """
+    Fill the database with `count` approvals, spread evenly over the
+    groups, users and, if django-registration is installed,
+    registration profiles that they are for. Half of them are
+    approved.
+    """
+    per_type = count / 3
+    groups = new_groups('seed', per_type)
+    users = [User.objects.create_user('seed%d' % i, 'seed%d@example.com' % i)
+             for i in range(count - 2 * per_type)]
+    if RegistrationProfile is not None:
+        profiles = [RegistrationProfile.objects.create_profile(u)
+                    for u in users[:per_type]]
+    else:
+        profiles = new_groups('seed profile', per_type)
+
+    # One type at a time, so that the approvals are always in the same
+    # order and so are the pages we benchmark. `request_many()` does
+    # not keep the order of the models it is given.
+    #
+    for objects in (groups, users, profiles):
+        Approval.objects.request_many(objects)
+
+    # Decide every other approval, but not through the batch signal
+    # which would send registration activation emails.
+    #
+    ids = list(Approval.objects.values_list('id', flat = True))[::2]
+    Approval.objects.filter(id__in = ids).update(
+        **decision_values(True, approver, "seeded"))
+    PendingCount.objects.reconcile()
+    OutboxEntry.objects.all().delete()
+    return
+
+####################################################################
+#
+@benchmark('create')
+def create(env):
+    """
+    Create approvals one at a time with `Approval.save()`.
+    """
+    groups = new_groups('create', env['options'].ops)
+
+    def run():
+        for group in groups:
+            Approval(needs_approval = group).save()
+    return len(groups), run
+
+####################################################################
+#
+@benchmark('deliver_outbox')
+def deliver_outbox(env):
+    """
+    Deliver the notifications queued by the 'create' benchmark through
+    the locmem mail backend.
+    """
+    count = OutboxEntry.objects.filter(status = OutboxEntry.PENDING).count()
+    mail.outbox = []
+
+    def run():
+        OutboxEntry.objects.deliver_due(count)
+    return count, run
+
+####################################################################
+#
+@benchmark('approve')
+def approve(env):
+    """
+    Decide approvals one at a time with `Approval.approve()`. These
+    are the newest pending approvals, the ones 'create' made, so that
+    the first page of the pending queue is the same whatever '--ops'
+    is.
+    """
+    approvals = group_approvals(None, env['options'].ops, newest = True)
+
+    def run():
+        for approval in approvals:
+            approval.approve(True, env['approver'], "benchmark")
+    return len(approvals), run
+
+####################################################################
+#
+def page(url, env):
+    """
+    The (ops, run) pair for a benchmark requesting `url` '--pages'
+    times, after one request to warm up caches.
+    """
+    get(env['client'], url)
+
+    def run():
+        for i in range(env['options'].pages):
+            get(env['client'], url)
+    return env['options'].pages, run
+
+####################################################################
+#
+@benchmark('admin_changelist')
+def admin_changelist(env):
+    """
+    The first page of approvals for groups in the admin. The page is
+    filtered to the one content type so that it costs the same number
+    of queries whatever '--approvals' is; the objects the approvals
+    are for are fetched with a query per content type on the page.
+    """
+    ct = ContentType.objects.get_for_model(Group)
+    return page("%s?content_type__id__exact=%d" % (
+            reverse('admin:approvals_approval_changelist'), ct.id), env)
+
+####################################################################
+#
+@benchmark('pending_queue')
+def pending_queue(env):
+    """
+    The first page of the pending approvals view.
+    """
+    return page(reverse('approvals_pending'), env)
+
+####################################################################
+#
+@benchmark('registration_queue')
+def registration_queue(env):
+    """
+    The first page of the pending registrations, if
+    django-registration is installed.
+    """
+    if RegistrationProfile is None:
+        return None
+    return page(reverse('registration_approvals_list'), env)
+
+####################################################################
+#
+@benchmark('act_on_pending')
+def act_on_pending(env):
+    """
+    The 'act_on_approval' page of pending approvals.
+    """
+    urls = [a.act_on_url() for a in group_approvals(None,
+                                                    env['options'].pages)]
+    get(env['client'], urls[0])
+
+    def run():
+        for url in urls:
+            get(env['client'], url)
+    return len(urls), run
+
+####################################################################
+#
+@benchmark('act_on_processed')
+def act_on_processed(env):
+    """
+    The 'act_on_approval' page of approved approvals, each shown for
+    the first time.
+    """
+    urls = [a.act_on_url() for a in group_approvals(True,
+                                                    env['options'].pages)]
+
+    def run():
+        for url in urls:
+            get(env['client'], url)
+    return len(urls), run
+
+####################################################################
+#
+@benchmark('act_on_processed_cached')
+def act_on_processed_cached(env):
+    """
+    The 'act_on_approval' page of an approved approval, served from
+    the cache.
+    """
+    return page(group_approvals(True, 1)[0].act_on_url(), env)
+
+####################################################################
+#
+@benchmark('notify_fan_out')
+def notify_fan_out(env):
+    """
+    Email a digest of new approvals to '--ops' more staff approvers
+    than there were. However many approvers there are, each digest
+    has to go over one mail server connection. This adds approvers,
+    so it runs last.
+    """
+    for i in range(env['options'].ops):
+        User.objects.create_user('fan%d' % i, 'fan%d@example.com' % i)
+    User.objects.filter(username__startswith = 'fan').update(is_staff = True)
+    recipients.invalidate()
+    counts = { ContentType.objects.get_for_model(Group).id : 1 }
+    notify.notify_digest(counts)
+
+    def run():
+        before = CountingEmailBackend.connections
+        for i in range(env['options'].pages):
+            notify.notify_digest(counts)
+        opened = CountingEmailBackend.connections - before
+        if opened != env['options'].pages:
+            raise RuntimeError("%d digests opened %d connections" % (
+                    env['options'].pages, opened))
+    return env['options'].pages, run
+
+####################################################################
+#
+def measure(func):
+    """
+    Run `func`, returning the seconds it took and the number of queries
+    it made.
+    """
+    reset_queries()
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    return elapsed, len(connection.queries)
+
+####################################################################
+#
+def peak_rss():
+    """
+    The peak resident set size of this process so far, in kilobytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+####################################################################
+#
+def run_benchmarks(options):
+    """
+    Seed the test database and run the benchmarks. Returns a list of
+    (name, ops, seconds, queries per op, peak rss) tuples.
+    """
+    approver = User.objects.create_user('approver', 'approver@example.com',
+                                        'approver')
+    approver.is_staff = approver.is_superuser = True
+    approver.save()
+    seed(options.approvals, approver)
+
+    client = Client()
+    client.login(username = 'approver', password = 'approver')
+    env = { 'options'  : options,
+            'client'   : client,
+            'approver' : approver }
+
+    results = []
+    for name, func in BENCHMARKS:
+        if options.only and name not in options.only:
+            continue
+        setup = func(env)
+        if setup is None:
+            continue
+        ops, run = setup
+        elapsed, queries = measure(run)
+        results.append((name, ops, elapsed,
+                        round(float(queries) / max(ops, 1), 2), peak_rss()))
+    return results
+
+####################################################################
+#
+def whole_queries(queries):
+    """
+    The whole number of queries per op in `queries`, the average. What
+    is left over are the queries made once per run, such as fetching a
+    batch, spread over the ops, which is less than one as long as
+    '--ops' is at least 5.
+    """
+    return int(queries)
+
+####################################################################
+#
+def compare(results, baseline):
+    """
+    Return the list of (name, queries per op, baseline) for the results
+    that made more whole queries per op than their baseline.
+    """
+    regressions = []
+    for name, ops, elapsed, queries, rss in results:
+        if name in baseline and whole_queries(queries) > baseline[name]:
+            regressions.append((name, queries, baseline[name]))
+    return regressions
+
+####################################################################
+#
+def main():
+    parser = OptionParser(usage = "python -m benchmarks.run [options]")
+    parser.add_option('--approvals', type = 'int', default = 3000,
+                      help = 'Number of approvals to seed the database with.')
+    parser.add_option('--ops', type = 'int', default = 200,
+                      help = 'Number of approvals to create and to decide.')
+    parser.add_option('--pages', type = 'int', default = 20,
+                      help = 'Number of times to request each page.')
+    parser.add_option('--only', action = 'append', default = [],
+                      help = 'Only run the named benchmark. May be given '
+                      'more than once.')
+    parser.add_option('--update-baseline', action = 'store_true',
+                      default = False,
+                      help = "Record this run's query counts as the "
+                      "baseline for this database backend.")
+    options, args = parser.parse_args()
+
+    # The test client resets the list of queries at the start of every
+    # request, which would lose the ones we are counting.
+    #
+    signals.request_started.disconnect(reset_queries)
+
+    backend = settings.DATABASES['default']['ENGINE'].split('.')[-1]
+    old_name = connection.creation.create_test_db(verbosity = 0,
+                                                  autoclobber = True)
+    try:
+        results = run_benchmarks(options)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity = 0)
+
+    print "%-26s %6s %10s %10s %10s %10s" % ('benchmark', 'ops', 'seconds',
+                                             'ms/op', 'queries/op',
+                                             'peak KB')
+    for name, ops, elapsed, queries, rss in results:
+        print "%-26s %6d %10.3f %10.2f %10.2f %10d" % (
+            name, ops, elapsed, elapsed * 1000 / max(ops, 1), queries, rss)
+
+    baselines = {}
+    if os.path.exists(BASELINE):
+        baselines = simplejson.load(open(BASELINE))
+
+    if options.update_baseline:
+        baseline = baselines.setdefault(backend, {})
+        for name, ops, elapsed, queries, rss in results:
+            baseline[name] = whole_queries(queries)
+        out = open(BASELINE, 'w')
+        simplejson.dump(baselines, out, indent = 4, sort_keys = True,
+                        separators = (',', ': '))
+        out.write('\n')
+        out.close()
+        print "Baseline for %s updated" % backend
+        return 0
+
+    if backend not in baselines:
+        print "No baseline for %s; run with --update-baseline to record " \
+            "one" % backend
+        return 0
+    regressions = compare(results, baselines[backend])
+    for name, queries, expected in regressions:
+        print "REGRESSION: %s made %.2f queries per op, baseline is %d" % (
+            name, queries, expected)
+    return regressions and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#
+# File: $Id$
+#
+"""
+Django settings for running the approvals benchmarks.
+
+They run against SQLite by default. To run them against PostgreSQL
+set APPROVALS_BENCH_DATABASE to 'postgresql' and, as needed,
+APPROVALS_BENCH_DB_NAME, APPROVALS_BENCH_DB_USER,
+APPROVALS_BENCH_DB_PASSWORD, APPROVALS_BENCH_DB_HOST and
+APPROVALS_BENCH_DB_PORT. The benchmarks create and destroy their own
+test database ('test_' plus the name) so the user needs to be allowed
+to create databases.
+"""
+
+# Python standard imports
+#
+import os
+import imp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# We need DEBUG for Django to record the queries that we count.
+#
+DEBUG = True
+TEMPLATE_DEBUG = False
+
+if os.environ.get('APPROVALS_BENCH_DATABASE') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE'   : 'django.db.backends.postgresql_psycopg2',
+            'NAME'     : os.environ.get('APPROVALS_BENCH_DB_NAME',
+                                        'approvals_bench'),
+            'USER'     : os.environ.get('APPROVALS_BENCH_DB_USER', ''),
+            'PASSWORD' : os.environ.get('APPROVALS_BENCH_DB_PASSWORD', ''),
+            'HOST'     : os.environ.get('APPROVALS_BENCH_DB_HOST', ''),
+            'PORT'     : os.environ.get('APPROVALS_BENCH_DB_PORT', ''),
+            },
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE' : 'django.db.backends.sqlite3',
+            'NAME'   : os.path.join(BENCH_DIR, 'bench.sqlite'),
+            },
+        }
+
+INSTALLED_APPS = (
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.sites',
+    'django.contrib.admin',
+    'django.contrib.messages',
+    'approvals',
+    )
+
+# The registration queue is only benchmarked if django-registration is
+# around. It is looked for rather than imported so that
+# 'benchmarks.imports' only sees what the approvals app imports.
+#
+try:
+    imp.find_module('registration')
+    INSTALLED_APPS += ('registration',)
+except ImportError:
+    pass
+
+MIDDLEWARE_CLASSES = (
+    'django.middleware.common.CommonMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    )
+
+ROOT_URLCONF = 'benchmarks.urls'
+TEMPLATE_DIRS = (os.path.join(BENCH_DIR, 'templates'),)
+EMAIL_BACKEND = 'benchmarks.backends.CountingEmailBackend'
+CACHE_BACKEND = 'locmem://'
+SITE_ID = 1
+SECRET_KEY = 'approvals-benchmarks'
+LOGIN_URL = '/accounts/login/'
+ACCOUNT_ACTIVATION_DAYS = 7
@@ -0,0 +1,24 @@
+#
+# File: $Id$
+#
+"""
+URLConf for the approvals benchmarks.
+"""
+
+from django.conf import settings
+from django.conf.urls.defaults import *
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = patterns(
+    '',
+    (r'^admin/', include(admin.site.urls)),
+    (r'^approvals/', include('approvals.urls')),
+    )
+
+if 'registration' in settings.INSTALLED_APPS:
+    urlpatterns += patterns(
+        '',
+        (r'^accounts/', include('approvals.accounts_urls')),
+        )